@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from gemini_client import MODEL_NAME, generate_content, init_vertex
+from metrics import count_error, increment
+
+# --- CONFIGURATION ---
+CHECKPOINT_PATH = "backlog_checkpoint.json"
+BATCH_DIR = "backlog_batches"
+# Request label carrying the Gmail message ID through the job. Vertex echoes
+# each request next to its response, in no particular order.
+KEY_LABEL = "email_id"
+DEFAULT_POLL_INTERVAL = 60
+DEFAULT_LOCAL_WORKERS = 4
+
+
+class BatchJobFailed(RuntimeError):
+    """A batch prediction job ended without succeeding (failed, cancelled or expired)."""
+
+
+# --- JSONL in Vertex AI's Gemini batch format ---
+def request_line(key, prompt):
+    return {
+        'request': {
+            'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+            'labels': {KEY_LABEL: key},
+        }
+    }
+
+def _prompt_of(request):
+    return "".join(part.get('text', "") for content in request.get('contents', [])
+                   for part in content.get('parts', []))
+
+def write_requests(path, items):
+    """Write (key, prompt) pairs as a batch prediction input file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        for key, prompt in items:
+            f.write(json.dumps(request_line(key, prompt)) + "\n")
+    return path
+
+def read_requests(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def read_results(output_paths, input_path):
+    """Map each key to its reply text, or to None when that request failed.
+
+    Keys come from the request label; prompts are matched back to the input
+    file for output that lost it.
+    """
+    keys_by_prompt = {_prompt_of(r['request']): r['request']['labels'][KEY_LABEL] for r in read_requests(input_path)}
+    results = {}
+    for path in output_paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                request = record.get('request', {})
+                key = request.get('labels', {}).get(KEY_LABEL) or keys_by_prompt.get(_prompt_of(request))
+                if key is None:
+                    continue
+                candidates = (record.get('response') or {}).get('candidates') or []
+                parts = candidates[0].get('content', {}).get('parts', []) if candidates else []
+                text = "".join(part.get('text', "") for part in parts)
+                if record.get('status') or not text:
+                    results.setdefault(key, None)
+                else:
+                    results[key] = text
+    return results
+
+
+# --- runners ---
+def run_local(input_path, output_path, project, location, model_name=MODEL_NAME, max_workers=DEFAULT_LOCAL_WORKERS):
+    """Stand-in for a Vertex batch job: answer each input line with generate_content.
+
+    Output lines use the same format Vertex writes and are appended as
+    they finish, so a rerun after a crash only sends the requests that
+    have no result yet.
+    """
+    done = set(read_results([output_path], input_path)) if os.path.exists(output_path) else set()
+    pending = [r for r in read_requests(input_path) if r['request']['labels'][KEY_LABEL] not in done]
+    write_lock = threading.Lock()
+
+    def run(record):
+        request = record['request']
+        try:
+            text = generate_content(project, location, _prompt_of(request), model_name=model_name).text
+            result = {'request': request, 'status': "",
+                      'response': {'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}}]}}
+        except Exception as e:
+            count_error('batch_request')
+            result = {'request': request, 'status': str(e)}
+        result['processed_time'] = datetime.now().isoformat()
+        with write_lock, open(output_path, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+
+    if pending:
+        print(f"Generating {len(pending)} backlog replies locally ({len(done)} already done).")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            list(pool.map(run, pending))
+    return [output_path]
+
+def submit_vertex(input_path, project, location, gcs_uri, model_name=MODEL_NAME):
+    """Upload the input file under gcs_uri and submit a batch prediction job; returns its resource name."""
+    from google.cloud import storage
+    from vertexai.batch_prediction import BatchPredictionJob
+
+    init_vertex(project, location)
+    bucket_name, _, prefix = gcs_uri[len("gs://"):].partition('/')
+    blob_name = "/".join(p for p in (prefix.strip('/'), os.path.basename(input_path)) if p)
+    storage.Client(project=project).bucket(bucket_name).blob(blob_name).upload_from_filename(input_path)
+    job = BatchPredictionJob.submit(
+        source_model=model_name,
+        input_dataset=f"gs://{bucket_name}/{blob_name}",
+        output_uri_prefix=f"{gcs_uri.rstrip('/')}/output",
+    )
+    increment('batch_jobs_submitted')
+    print(f"Submitted batch prediction job {job.resource_name}")
+    return job.resource_name
+
+def wait_vertex(job_name, project, location, output_dir, poll_interval=DEFAULT_POLL_INTERVAL):
+    """Wait for a submitted job to end and download its prediction files into output_dir.
+
+    Raises BatchJobFailed if the job ended in any state but success.
+    """
+    from google.cloud import storage
+    from vertexai.batch_prediction import BatchPredictionJob
+
+    init_vertex(project, location)
+    job = BatchPredictionJob(job_name)
+    while not job.has_ended:
+        print(f"Batch job {job.state.name}; checking again in {poll_interval}s.")
+        time.sleep(poll_interval)
+        job.refresh()
+    if not job.has_succeeded:
+        raise BatchJobFailed(f"Batch prediction job {job_name} ended as {job.state.name}: {job.error}")
+    bucket_name, _, prefix = job.output_location[len("gs://"):].partition('/')
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for blob in storage.Client(project=project).list_blobs(bucket_name, prefix=prefix.rstrip('/') + '/'):
+        if blob.name.endswith('.jsonl'):
+            path = os.path.join(output_dir, blob.name.replace('/', '_'))
+            blob.download_to_filename(path)
+            paths.append(path)
+    return paths
+
+
+# --- checkpoint ---
+class BacklogCheckpoint:
+    """Progress of one backlog run, rewritten atomically after every step.
+
+    Holds the emails in the batch (so a resumed run needs no Gmail fetch),
+    the input file, the submitted job and its result files, and which emails
+    already have a draft and saved history.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH, state=None):
+        self.path = path
+        self.state = state or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=CHECKPOINT_PATH):
+        """Return the checkpoint left by an unfinished run, or None."""
+        try:
+            with open(path, 'r') as f:
+                return cls(path, json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def update(self, **fields):
+        with self._lock:
+            self.state.update(fields)
+            self._write()
+
+    def mark_delivered(self, key):
+        with self._lock:
+            self.state.setdefault('delivered', []).append(key)
+            self._write()
+
+    def delivered(self):
+        with self._lock:
+            return set(self.state.get('delivered', []))
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        for path in [self.state.get('input_path')] + self.state.get('output_paths', []):
+            if path and os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self.path):
+            os.remove(self.path)
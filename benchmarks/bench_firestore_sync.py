@@ -0,0 +1,41 @@
+import argparse
+import contextlib
+import io
+
+from benchmarks.fakes import FakeFirestoreClient
+from benchmarks.synthetic import make_properties
+from upload_to_firestore import sync_properties, COLLECTION_NAME
+
+
+def bench(n_rows, latency, max_in_flight):
+    db = FakeFirestoreClient(latency=latency)
+    df = make_properties(n_rows)
+    edited = df.copy()
+    changed = max(1, n_rows // 100)
+    edited.loc[edited.index[:changed], 'Rent '] += 50
+    edited = edited.iloc[:-changed]
+
+    runs = [('initial load', df), ('unchanged re-run', df), (f'{changed} edited + {changed} removed', edited)]
+    for label, frame in runs:
+        before = sum(db.round_trips.values())
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = sync_properties(db, frame, mode='batch', max_in_flight=max_in_flight)
+        round_trips = sum(db.round_trips.values()) - before
+        print(f"{n_rows:>7} rows | {label:<26} | wrote {stats['written']:>6} deleted {stats['deleted']:>4} "
+              f"skipped {stats['unchanged']:>6} | {round_trips:>4} round-trips | "
+              f"{stats['rows_per_second']:>10.0f} rows/sec")
+    assert len(db.collection(COLLECTION_NAME).docs) == len(edited)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Firestore property sync against an in-memory fake.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per Firestore round-trip")
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    args = parser.parse_args()
+    for n_rows in args.rows:
+        bench(n_rows, args.latency, args.max_in_flight)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import base64
+import time
+from collections import Counter
+
+from benchmarks.synthetic import make_mime_corpus, make_properties
+from mime_parser import parse_body, DEFAULT_MAX_BYTES
+from prompt_builder import count_tokens
+
+
+def legacy_body(payload):
+    """The body extraction parse_message used before mime_parser."""
+    body = ""
+    if 'data' in payload.get('body', {}):
+        body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='replace')
+    else:
+        for part in payload.get('parts', []):
+            if part['mimeType'] == 'text/plain' and 'data' in part['body']:
+                body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='replace')
+                break
+    return body
+
+
+def bench(name, parse, corpus, input_bytes):
+    start = time.perf_counter()
+    bodies = [parse(payload) for _, payload in corpus]
+    elapsed = time.perf_counter() - start
+    empty = Counter(kind for (kind, _), body in zip(corpus, bodies) if not body.strip())
+    tokens = sum(count_tokens(body) for body in bodies)
+    print(f"{name:<7} | {len(corpus) / elapsed:>9.0f} msgs/s | {input_bytes / elapsed / 1e6:>7.1f} MB/s | "
+          f"{tokens / len(corpus):>7.1f} prompt tokens/msg | empty bodies: {sum(empty.values())} "
+          f"{dict(empty) if empty else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark email body parsing throughput and output size.")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = make_mime_corpus(args.messages, make_properties(100), seed=args.seed)
+    input_bytes = 0
+    stack = [payload for _, payload in corpus]
+    while stack:
+        part = stack.pop()
+        stack.extend(part.get('parts', []))
+        input_bytes += len(part.get('body', {}).get('data', ''))
+    print(f"{args.messages} messages, {Counter(kind for kind, _ in corpus)}, {input_bytes / 1e6:.1f} MB of base64")
+    bench("legacy", legacy_body, corpus, input_bytes)
+    bench("mime", lambda payload: parse_body(payload, max_bytes=args.max_bytes), corpus, input_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT = "bench-project"
+LOCATION = "us-central1"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _time_each_email(stages, latencies):
+    """Wrap the first and last stage so each email's end-to-end time is recorded."""
+    wrapped = list(stages)
+    first_name, first_fn, first_limit = wrapped[0]
+
+    def first(ctx):
+        ctx['bench_started'] = time.perf_counter()
+        first_fn(ctx)
+
+    wrapped[0] = (first_name, first, first_limit)
+    last_name, last_fn, last_limit = wrapped[-1]
+
+    def last(ctx):
+        last_fn(ctx)
+        latencies.append(time.perf_counter() - ctx['bench_started'])
+
+    wrapped[-1] = (last_name, last, last_limit)
+    return wrapped
+
+
+def run_scenario(scenario):
+    """Run one scenario in this process against fakes and return its results."""
+    import importlib
+
+    from benchmarks.fakes import FakeGenerativeModel, FakeGmailService
+    from benchmarks.synthetic import make_inbox, make_properties
+    from gemini_client import latency_summary, set_model
+    from triage import DEFAULT_LIGHT_MODEL
+    from gmail_client import ReadMarker, group_by_thread
+    from pipeline import drain_queue
+    from processing_ledger import get_ledger
+    from rate_limit import throttle_summary
+    from settings import use_config
+
+    entry = importlib.import_module(scenario['entry'])
+    workdir = tempfile.mkdtemp(prefix="agent-bench-")
+    os.chdir(workdir)
+
+    df = make_properties(scenario['properties'])
+    df.to_excel("Properties Listing.xlsx", index=False)
+    config = {
+        'gmail_client_secret': 'unused.json',
+        'gcp_project': PROJECT,
+        'gcp_location': LOCATION,
+        'service_account_key': 'unused.json',
+        'gmail_batch_size': scenario['batch_size'],
+        'gmail_max_concurrency': scenario['fetch_concurrency'],
+        'reply_cache': scenario['reply_cache'],
+        'stream_replies': scenario['stream'],
+        'thread_mode': scenario['threads'],
+        'triage': scenario['triage'],
+        'processing_ledger': scenario['ledger'],
+        'stage_concurrency': {'generate': scenario['workers'], 'deliver': scenario['workers']},
+        # Keep the real quota pacing for Gmail, but let the fake model run
+        # unthrottled and retry injected errors quickly.
+        'rate_limits': {
+            'gmail': {'base_delay': 0.05},
+            'gemini': {'rate': 1000, 'burst': 1000, 'base_delay': 0.05},
+        },
+    }
+    use_config(config)
+
+    gmail = FakeGmailService(make_inbox(scenario['emails'], df, seed=scenario['seed'],
+                                        follow_up_rate=scenario['follow_up_rate'],
+                                        noise_rate=scenario['noise_rate']),
+                             latency=scenario['gmail_latency'], error_rate=scenario['error_rate'],
+                             seed=scenario['seed'])
+    model = FakeGenerativeModel(latency=scenario['gemini_latency'], error_rate=scenario['error_rate'],
+                                seed=scenario['seed'])
+    set_model(PROJECT, LOCATION, model)
+    set_model(PROJECT, LOCATION, model, model_name=DEFAULT_LIGHT_MODEL)
+
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        emails = entry.get_unread_emails(gmail, batch_size=config['gmail_batch_size'],
+                                         max_concurrency=config['gmail_max_concurrency'])
+        fetch_seconds = time.perf_counter() - start
+        ledger = get_ledger()
+        read_marker = None
+        if scenario['threads']:
+            read_marker = ReadMarker(gmail, on_flush=ledger.finish if ledger is not None else None)
+            emails = group_by_thread(emails)
+        stages = _time_each_email(entry.build_stages(gmail, config, read_marker=read_marker, ledger=ledger),
+                                  latencies)
+        summary = drain_queue(emails, stages, max_workers=scenario['workers'])
+        if read_marker is not None:
+            read_marker.flush()
+        elapsed = time.perf_counter() - start
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'scenario': scenario,
+        'fetched': len(emails),
+        'succeeded': summary['succeeded'],
+        'failed': summary['failed'],
+        'elapsed_seconds': elapsed,
+        'fetch_seconds': fetch_seconds,
+        'emails_per_second': summary['succeeded'] / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'peak_rss_mb': peak_kb / 1024 if sys.platform != 'darwin' else peak_kb / 1024 / 1024,
+        'first_token_avg_seconds': latency_summary()['first_token_avg_seconds'],
+        'throttling': throttle_summary(),
+        'gemini_calls': model.calls,
+        'gmail_calls': gmail.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the agent end to end against in-process Gmail and Gemini fakes.")
+    parser.add_argument('--entry', choices=['email_ai', 'draft_ai'], default='draft_ai')
+    parser.add_argument('--emails', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--properties', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--fetch-concurrency', type=int, default=4)
+    parser.add_argument('--gmail-latency', type=float, default=0.05, help="seconds per Gmail call")
+    parser.add_argument('--gemini-latency', type=float, default=0.3, help="base seconds per Gemini call")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls that fail with 429")
+    parser.add_argument('--reply-cache', action='store_true', help="leave the draft reply cache on")
+    parser.add_argument('--stream', action='store_true', help="stream Gemini replies (draft_ai only)")
+    parser.add_argument('--threads', action='store_true', help="reply once per Gmail thread")
+    parser.add_argument('--no-triage', action='store_true', help="send every email to the full prompt")
+    parser.add_argument('--ledger', action='store_true', help="claim and record every email in a processing ledger")
+    parser.add_argument('--noise-rate', type=float, default=0.0,
+                        help="fraction of synthetic emails that are auto-replies, newsletters or one-liners")
+    parser.add_argument('--follow-up-rate', type=float, default=0.0,
+                        help="fraction of synthetic emails that are follow-ups in an earlier thread")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print raw JSON results")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(json.loads(args.child))))
+        return
+
+    results = []
+    print(f"{'entry':<9} {'emails':>6} {'props':>6} {'ok':>5} {'fail':>4} {'emails/s':>9} "
+          f"{'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'peak MB':>8}")
+    for n_props in args.properties:
+        for n_emails in args.emails:
+            scenario = {
+                'entry': args.entry, 'emails': n_emails, 'properties': n_props,
+                'workers': args.workers, 'batch_size': args.batch_size,
+                'fetch_concurrency': args.fetch_concurrency,
+                'gmail_latency': args.gmail_latency, 'gemini_latency': args.gemini_latency,
+                'error_rate': args.error_rate, 'reply_cache': args.reply_cache, 'stream': args.stream,
+                'threads': args.threads, 'follow_up_rate': args.follow_up_rate,
+                'triage': not args.no_triage, 'noise_rate': args.noise_rate, 'ledger': args.ledger,
+                'seed': args.seed,
+            }
+            # Each scenario gets a fresh interpreter so module-level caches and
+            # peak RSS don't leak between runs.
+            proc = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pipeline', '--child',
+                                   json.dumps(scenario)], cwd=REPO_ROOT, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr)
+                sys.exit(proc.returncode)
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{args.entry:<9} {n_emails:>6} {n_props:>6} {result['succeeded']:>5} {result['failed']:>4} "
+                  f"{result['emails_per_second']:>9.2f} {result['p50']:>7.3f} {result['p95']:>7.3f} "
+                  f"{result['p99']:>7.3f} {result['peak_rss_mb']:>8.1f}")
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import random
+import time
+
+from benchmarks.synthetic import make_properties, make_inquiry
+from property_catalog import render_property_context
+from property_index import PropertyIndex, DEFAULT_TOP_K
+
+
+def bench(n_rows, n_queries, top_k):
+    df = make_properties(n_rows)
+    full_chars = len(render_property_context(df))
+
+    start = time.perf_counter()
+    index = PropertyIndex(df)
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(1)
+    queries = [make_inquiry(df, rng) for _ in range(n_queries)]
+    start = time.perf_counter()
+    for query in queries:
+        rows = index.search(query, top_k=top_k)
+    query_seconds = (time.perf_counter() - start) / n_queries
+    retrieved_chars = len(render_property_context(df.iloc[rows]))
+
+    print(f"{n_rows:>7} rows | build {build_seconds * 1000:8.1f} ms | "
+          f"query {query_seconds * 1e6:8.1f} us | "
+          f"context {retrieved_chars:>6} chars (full dump {full_chars} chars)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark property index build and query time.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+    args = parser.parse_args()
+    for n_rows in args.rows:
+        bench(n_rows, args.queries, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+import itertools
+import random
+import threading
+import time
+
+import httplib2
+from google.api_core.exceptions import ResourceExhausted
+from googleapiclient.errors import HttpError
+
+
+class _Faults:
+    """Shared latency and error injection for the fakes."""
+
+    def __init__(self, latency, error_rate, seed):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def sleep(self, extra=0.0):
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+
+def _rate_limited():
+    return HttpError(httplib2.Response({'status': 429}), b'{"error": {"message": "Rate Limit Exceeded"}}')
+
+
+def _not_found():
+    return HttpError(httplib2.Response({'status': 404}), b'{"error": {"message": "Requested entity was not found."}}')
+
+
+class FakeRequest:
+    """Stands in for googleapiclient.http.HttpRequest."""
+
+    def __init__(self, service, method, fn):
+        self.service = service
+        self.method = method
+        self.fn = fn
+
+    def execute(self, http=None, num_retries=0):
+        self.service._count(self.method)
+        self.service.faults.sleep()
+        if self.service.faults.should_fail():
+            raise _rate_limited()
+        return self.fn()
+
+
+class FakeBatch:
+    """Stands in for googleapiclient.http.BatchHttpRequest: one round-trip for all calls."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self, http=None):
+        self.service._count('batch')
+        self.service.faults.sleep()
+        for request_id, request, callback in self.requests:
+            self.service._count(request.method)
+            if self.service.faults.should_fail():
+                callback(request_id, None, _rate_limited())
+            else:
+                callback(request_id, request.fn(), None)
+
+
+class FakeGmailService:
+    """In-process Gmail API covering the calls the agent makes.
+
+    `messages` are Gmail message resources in format=full (see
+    benchmarks.synthetic.make_inbox). Every request sleeps for `latency`
+    seconds and fails with a 429 at `error_rate`.
+    """
+
+    def __init__(self, messages=(), latency=0.0, error_rate=0.0, seed=0):
+        self.faults = _Faults(latency, error_rate, seed)
+        self._lock = threading.Lock()
+        self.inbox = {}
+        self.order = []
+        self.history_log = []
+        self.history_id = 1
+        self.sent = []
+        self.draft_store = {}
+        self.calls = {}
+        for message in messages:
+            self.deliver(message)
+
+    # --- test helpers ---
+    def deliver(self, message):
+        """Add a message to the inbox, recording a messageAdded history event."""
+        with self._lock:
+            message = dict(message, labelIds=list(message.get('labelIds', [])))
+            self.inbox[message['id']] = message
+            self.order.insert(0, message['id'])
+            self.history_id += 1
+            self.history_log.append((self.history_id, message['id']))
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    # --- resources ---
+    def users(self):
+        return self
+
+    def messages(self):
+        return _Messages(self)
+
+    def drafts(self):
+        return _Drafts(self)
+
+    def history(self):
+        return _History(self)
+
+    def getProfile(self, userId='me'):
+        return FakeRequest(self, 'getProfile', lambda: {'historyId': str(self.history_id)})
+
+
+class _Messages:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', labelIds=None, q=None, maxResults=100, pageToken=None, **kwargs):
+        def run():
+            svc = self.service
+            with svc._lock:
+                wanted = set(labelIds or [])
+                if q and 'is:unread' in q:
+                    wanted.add('UNREAD')
+                ids = [i for i in svc.order if wanted.issubset(svc.inbox[i]['labelIds'])]
+            start = int(pageToken or 0)
+            page = ids[start:start + maxResults]
+            result = {'messages': [{'id': i, 'threadId': svc.inbox[i].get('threadId', i)} for i in page],
+                      'resultSizeEstimate': len(ids)}
+            if start + maxResults < len(ids):
+                result['nextPageToken'] = str(start + maxResults)
+            return result
+        return FakeRequest(self.service, 'messages.list', run)
+
+    def get(self, userId='me', id=None, format='full', **kwargs):
+        def run():
+            with self.service._lock:
+                return self.service.inbox[id]
+        return FakeRequest(self.service, 'messages.get', run)
+
+    def modify(self, userId='me', id=None, body=None):
+        def run():
+            with self.service._lock:
+                message = self.service.inbox[id]
+                message['labelIds'] = [l for l in message['labelIds'] if l not in body.get('removeLabelIds', [])]
+                return {'id': id, 'labelIds': message['labelIds']}
+        return FakeRequest(self.service, 'messages.modify', run)
+
+    def batchModify(self, userId='me', body=None):
+        def run():
+            with self.service._lock:
+                for msg_id in body.get('ids', []):
+                    message = self.service.inbox[msg_id]
+                    message['labelIds'] = [l for l in message['labelIds']
+                                           if l not in body.get('removeLabelIds', [])]
+            return {}
+        return FakeRequest(self.service, 'messages.batchModify', run)
+
+    def send(self, userId='me', body=None):
+        def run():
+            with self.service._lock:
+                self.service.sent.append(body)
+                return {'id': f"sent{len(self.service.sent)}", 'threadId': body.get('threadId', '')}
+        return FakeRequest(self.service, 'messages.send', run)
+
+
+class _Drafts:
+    def __init__(self, service):
+        self.service = service
+
+    def create(self, userId='me', body=None):
+        def run():
+            with self.service._lock:
+                draft_id = f"draft{len(self.service.draft_store) + 1}"
+                self.service.draft_store[draft_id] = body
+                return {'id': draft_id, 'message': {'id': f"m-{draft_id}"}}
+        return FakeRequest(self.service, 'drafts.create', run)
+
+    def update(self, userId='me', id=None, body=None):
+        def run():
+            with self.service._lock:
+                if id not in self.service.draft_store:
+                    raise _not_found()
+                self.service.draft_store[id] = body
+                return {'id': id, 'message': {'id': f"m-{id}"}}
+        return FakeRequest(self.service, 'drafts.update', run)
+
+    def delete(self, userId='me', id=None):
+        def run():
+            with self.service._lock:
+                self.service.draft_store.pop(id, None)
+                return ''
+        return FakeRequest(self.service, 'drafts.delete', run)
+
+
+class _History:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', startHistoryId=None, historyTypes=None, labelId=None,
+             maxResults=100, pageToken=None):
+        def run():
+            svc = self.service
+            with svc._lock:
+                start = int(startHistoryId)
+                records = [{'id': str(h), 'messagesAdded': [{'message': {
+                               'id': i, 'threadId': svc.inbox[i].get('threadId', i),
+                               'labelIds': list(svc.inbox[i]['labelIds'])}}]}
+                           for h, i in svc.history_log if h > start
+                           and (labelId is None or labelId in svc.inbox[i]['labelIds'])]
+                return {'history': records, 'historyId': str(svc.history_id)}
+        return FakeRequest(self.service, 'history.list', run)
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeGenerativeModel:
+    """Stands in for vertexai GenerativeModel.generate_content.
+
+    Latency is `latency` seconds plus `seconds_per_1k_prompt_tokens` for the
+    prompt and `seconds_per_output_token` for the reply, so prompt size shows
+    up in the numbers. Calls fail with ResourceExhausted at `error_rate`.
+    """
+
+    def __init__(self, latency=0.5, seconds_per_1k_prompt_tokens=0.02, seconds_per_output_token=0.002,
+                 reply_words=150, error_rate=0.0, seed=0):
+        self.faults = _Faults(latency, error_rate, seed)
+        self.seconds_per_1k_prompt_tokens = seconds_per_1k_prompt_tokens
+        self.seconds_per_output_token = seconds_per_output_token
+        self.reply_words = reply_words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def count_tokens_estimate(text):
+        return max(1, len(text) // 4)
+
+    def _reply(self, prompt):
+        words = ["Thank", "you", "for", "your", "interest", "in", "the", "property."]
+        return "Hi there,\n\n" + " ".join(words[i % len(words)] for i in range(self.reply_words)) + "\n\nBest,\nPandora"
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+        prompt_tokens = self.count_tokens_estimate(prompt)
+        reply = self._reply(prompt)
+        reply_tokens = self.count_tokens_estimate(reply)
+        usage = FakeUsageMetadata(prompt_tokens, reply_tokens)
+        if self.faults.should_fail():
+            self.faults.sleep()
+            raise ResourceExhausted("429 Quota exceeded for aiplatform.googleapis.com/generate_content")
+        prefill = prompt_tokens / 1000 * self.seconds_per_1k_prompt_tokens
+        if not stream:
+            self.faults.sleep(prefill + reply_tokens * self.seconds_per_output_token)
+            return FakeResponse(reply, usage)
+        return self._stream(reply, usage, prefill)
+
+    def _stream(self, reply, usage, prefill):
+        self.faults.sleep(prefill)
+        words = reply.split(" ")
+        chunk_words = 20
+        for i in range(0, len(words), chunk_words):
+            chunk = " ".join(words[i:i + chunk_words]) + (" " if i + chunk_words < len(words) else "")
+            time.sleep(self.count_tokens_estimate(chunk) * self.seconds_per_output_token)
+            last = i + chunk_words >= len(words)
+            yield FakeResponse(chunk, usage if last else None)
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self.parent = collection
+        self.id = doc_id
+
+    def get(self, transaction=None):
+        self.parent.client._round_trip('get')
+        with self.parent.client._lock:
+            return FakeDocumentSnapshot(self.id, self.parent.docs.get(self.id))
+
+    def set(self, data, merge=False):
+        self.parent.client._round_trip('set')
+        if merge:
+            with self.parent.client._lock:
+                data = dict(self.parent.docs.get(self.id, {}), **data)
+        self.parent._set(self.id, data)
+
+    def collection(self, name):
+        return self.parent.client.collection(f"{self.parent.name}/{self.id}/{name}")
+
+
+class FakeQuery:
+    def __init__(self, collection, fields=None, order=None, limit_count=None):
+        self.collection = collection
+        self.fields = fields
+        self.order = order
+        self.limit_count = limit_count
+
+    def order_by(self, field, direction='ASCENDING'):
+        return FakeQuery(self.collection, self.fields, (field, direction), self.limit_count)
+
+    def limit(self, count):
+        return FakeQuery(self.collection, self.fields, self.order, count)
+
+    def stream(self, transaction=None):
+        self.collection.client._round_trip('query')
+        with self.collection.client._lock:
+            items = list(self.collection.docs.items())
+        if self.order is not None:
+            field, direction = self.order
+            items.sort(key=lambda item: item[1].get(field), reverse=direction == 'DESCENDING')
+        if self.limit_count is not None:
+            items = items[:self.limit_count]
+        for doc_id, data in items:
+            if self.fields is not None:
+                data = {k: v for k, v in data.items() if k in self.fields}
+            yield FakeDocumentSnapshot(doc_id, dict(data))
+
+
+class FakeCollection:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.docs = {}
+        self._ids = itertools.count(1)
+
+    def _auto_id(self):
+        with self.client._lock:
+            return f"auto{next(self._ids):08d}"
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self, doc_id or self._auto_id())
+
+    def select(self, fields):
+        return FakeQuery(self, list(fields))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return FakeQuery(self).order_by(field, direction)
+
+    def add(self, data):
+        self.client._round_trip('add')
+        doc_id = self._auto_id()
+        self._set(doc_id, data)
+        return None, FakeDocumentReference(self, doc_id)
+
+    def stream(self):
+        return FakeQuery(self).stream()
+
+    def _set(self, doc_id, data):
+        with self.client._lock:
+            self.docs[doc_id] = dict(data)
+
+    def _delete(self, doc_id):
+        with self.client._lock:
+            self.docs.pop(doc_id, None)
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self.client = client
+        self.ops = []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append((ref, data, merge))
+
+    def delete(self, ref):
+        self.ops.append((ref, None, False))
+
+    def commit(self):
+        self.client._round_trip('commit')
+        self._apply()
+
+    def _apply(self):
+        for ref, data, merge in self.ops:
+            if data is None:
+                ref.parent._delete(ref.id)
+                continue
+            if merge:
+                with self.client._lock:
+                    data = dict(ref.parent.docs.get(ref.id, {}), **data)
+            ref.parent._set(ref.id, data)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Transaction driven by google.cloud.firestore.transactional.
+
+    Transactions on one client run one at a time: _begin takes the client's
+    transaction lock and _commit/_rollback release it, so a read-modify-write
+    inside one never interleaves with another. Writes are buffered until
+    commit, as in Firestore.
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    def _clean_up(self):
+        self.ops = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self.client._transaction_lock.acquire()
+        self._id = next(self.client._transaction_ids)
+
+    def _commit(self):
+        try:
+            self.client._round_trip('commit')
+            self._apply()
+        finally:
+            self._end()
+
+    def _rollback(self):
+        self._end()
+
+    def _end(self):
+        if self._id is not None:
+            self._clean_up()
+            self.client._transaction_lock.release()
+
+
+class FakeFirestoreClient:
+    """In-memory Firestore client with per-round-trip latency.
+
+    Supports the subset used by upload_to_firestore.sync_properties in
+    mode='batch' and by firestore_context: collections and subcollections,
+    document get/set(merge) and auto-ID document(), add, select/order_by/limit
+    queries, batch() and transaction() (for firestore.transactional).
+    There are no snapshot listeners, so FirestoreContextProvider falls back
+    to polling against it.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.collections = {}
+        self.round_trips = {}
+        self._lock = threading.Lock()
+        self._transaction_lock = threading.Lock()
+        self._transaction_ids = itertools.count(1)
+
+    def _round_trip(self, kind):
+        with self._lock:
+            self.round_trips[kind] = self.round_trips.get(kind, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        with self._lock:
+            if name not in self.collections:
+                self.collections[name] = FakeCollection(self, name)
+            return self.collections[name]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self):
+        return FakeTransaction(self)
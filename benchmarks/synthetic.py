@@ -0,0 +1,177 @@
+import base64
+import random
+
+import pandas as pd
+
+STREETS = ['Oak', 'Pine', 'Elm', 'Maple', 'Cedar', 'Birch', 'Willow', 'Poplar', 'Fir', 'Spruce',
+           'Ash', 'Chestnut', 'Walnut', 'Hickory', 'Magnolia', 'Juniper', 'Sycamore', 'Aspen']
+SUFFIXES = ['St', 'Ave', 'Rd', 'Ln', 'Dr', 'Ct', 'Blvd', 'Way']
+TOWNS = ['Anytown', 'Portland', 'Hollis', 'Springfield', 'Riverside', 'Fairview', 'Georgetown']
+PROPERTY_TYPES = ['Apartment', 'House', 'Condo', 'Townhouse', 'Studio', 'Loft']
+FEATURES = ['Hardwood floors', 'close to transport', 'Private garden', 'garage', 'pool access',
+            'Walk-in closet', 'balcony', 'Stainless steel appliances', 'modern kitchen',
+            'Large backyard', 'family-friendly', 'Recently renovated', 'secure building',
+            'Finished basement', 'near schools', 'Open floor plan', 'pets allowed',
+            'in-unit laundry', 'central air', 'rooftop deck', 'doorman', 'parking included']
+
+
+def make_properties(n_rows, seed=0):
+    """Return a DataFrame shaped like 'Properties Listing.xlsx' with n_rows listings."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_rows):
+        bedrooms = rng.randint(0, 5)
+        rows.append({
+            'Address': f"{100 + i} {rng.choice(STREETS)} {rng.choice(SUFFIXES)}, {rng.choice(TOWNS)}, USA",
+            'Bedrooms': float(bedrooms),
+            'Bathrooms': float(rng.randint(1, max(1, bedrooms))),
+            'Rent ': float(rng.randrange(700, 6000, 50)),
+            'Property Type': rng.choice(PROPERTY_TYPES),
+            'Additional Features': ", ".join(rng.sample(FEATURES, 2)),
+            'Availability ': rng.choice(['Available', 'Not Available']),
+        })
+    return pd.DataFrame(rows)
+
+
+def make_inquiry(df, rng):
+    """Return a tenant email body that asks about one listing in df."""
+    row = df.iloc[rng.randrange(len(df))]
+    street = row['Address'].split(',')[0]
+    templates = [
+        f"Hi, is the {int(row['Bedrooms'])} bedroom {row['Property Type'].lower()} at {street} still available? Are pets allowed?",
+        f"Hello! I saw your listing for {street}. What is the rent and when can I schedule a showing?",
+        f"Interested in {street}. Does it have {row['Additional Features'].split(',')[0].lower()}? Thanks, Sam",
+        f"Do you have any {row['Property Type'].lower()}s with {int(row['Bedrooms'])} bedrooms under ${int(row['Rent ']) + 200}?",
+    ]
+    return rng.choice(templates)
+
+
+FIRST_NAMES = ['Sam', 'Alex', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn']
+
+
+NOISE = [
+    # (extra headers, sender, body) for mail that needs no full reply
+    ([{'name': 'List-Unsubscribe', 'value': '<mailto:unsubscribe@news.example.com>'}],
+     "Rental News <news@news.example.com>", "This week's top listings and market trends. Click to read more."),
+    ([{'name': 'Auto-Submitted', 'value': 'auto-replied'}],
+     None, "I am out of the office until Monday with limited access to email."),
+    ([], "Mail Delivery Subsystem <mailer-daemon@example.com>", "Delivery to the following recipient failed permanently."),
+    ([], None, "Thanks so much!"),
+    ([], None, "Perfect, thank you"),
+    ([], None, "Can we move the showing to Thursday at 5 instead?"),
+]
+
+
+def make_inbox(n_messages, df, seed=0, n_senders=None, follow_up_rate=0.0, noise_rate=0.0):
+    """Return n_messages unread Gmail API message resources (format=full) asking about df.
+
+    With follow_up_rate > 0 that fraction of messages are follow-ups in the
+    sender's previous thread (same threadId, In-Reply-To/References set).
+    With noise_rate > 0 that fraction are newsletters, auto-replies, bounces,
+    thank-you one-liners and scheduling questions instead of inquiries.
+    """
+    rng = random.Random(seed)
+    n_senders = n_senders or max(1, n_messages // 2)
+    messages = []
+    last_thread = {}
+    for i in range(n_messages):
+        sender_id = rng.randrange(n_senders)
+        name = FIRST_NAMES[sender_id % len(FIRST_NAMES)]
+        body = make_inquiry(df, rng) + f"\n\nThanks,\n{name}"
+        message_id = f"<msg{i:06d}@example.com>"
+        sender = f"{name} <tenant{sender_id}@example.com>"
+        extra_headers = []
+        if noise_rate and rng.random() < noise_rate:
+            extra_headers, noise_sender, body = rng.choice(NOISE)
+            sender = noise_sender or sender
+        headers = [
+            {'name': 'Subject', 'value': f"Inquiry #{i}"},
+            {'name': 'From', 'value': sender},
+            {'name': 'Message-ID', 'value': message_id},
+        ] + extra_headers
+        thread_id = f"thread{i:06d}"
+        previous = last_thread.get(sender_id)
+        if previous is not None and rng.random() < follow_up_rate:
+            thread_id, subject, parent_id = previous
+            headers[0]['value'] = f"Re: {subject}"
+            headers += [{'name': 'In-Reply-To', 'value': parent_id},
+                        {'name': 'References', 'value': parent_id}]
+        else:
+            subject = headers[0]['value']
+        last_thread[sender_id] = (thread_id, subject, message_id)
+        messages.append({
+            'id': f"msg{i:06d}",
+            'threadId': thread_id,
+            'labelIds': ['UNREAD', 'CATEGORY_PERSONAL', 'INBOX'],
+            'internalDate': str(1700000000000 + i * 1000),
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': headers,
+                'body': {'data': base64.urlsafe_b64encode(body.encode()).decode()},
+            },
+        })
+    return messages
+
+
+def _b64(text, charset='utf-8'):
+    return base64.urlsafe_b64encode(text.encode(charset)).decode()
+
+
+def _quoted_history(rng, depth):
+    lines = []
+    for level in range(1, depth + 1):
+        lines.append(f"{'>' * (level - 1)} On Mon, Jan {level}, 2024 at 9:{level:02d} AM Pandora <pandora@example.com> wrote:")
+        for _ in range(rng.randint(5, 15)):
+            lines.append(f"{'>' * level} Thank you for your interest in the property. The rent includes water and trash.")
+    return "\n".join(lines)
+
+
+def make_mime_corpus(n_messages, df, seed=0):
+    """Return Gmail message payloads in the shapes real tenant mail arrives in.
+
+    Mixes plain text, HTML-only, multipart/alternative nested inside
+    multipart/mixed with an attachment, long quoted reply chains and
+    Outlook-style replies with signatures.
+    """
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(n_messages):
+        question = make_inquiry(df, rng)
+        name = rng.choice(FIRST_NAMES)
+        plain = f"{question}\n\nThanks,\n{name}"
+        html = (f'<html><head><style>p {{margin:0}}</style></head><body><div dir="ltr"><p>{question}</p>'
+                f'<p>Thanks,<br>{name}</p></div>')
+        kind = rng.choice(['plain', 'html', 'nested', 'quoted', 'outlook'])
+        if kind == 'plain':
+            payload = {'mimeType': 'text/plain', 'body': {'data': _b64(plain)}}
+        elif kind == 'html':
+            payload = {'mimeType': 'text/html', 'body': {'data': _b64(html + '</body></html>')}}
+        elif kind == 'nested':
+            payload = {'mimeType': 'multipart/mixed', 'parts': [
+                {'mimeType': 'multipart/alternative', 'parts': [
+                    {'mimeType': 'text/plain', 'body': {'data': _b64(plain)}},
+                    {'mimeType': 'text/html', 'body': {'data': _b64(html + '</body></html>')}},
+                ]},
+                {'mimeType': 'application/pdf', 'filename': 'pay_stub.pdf',
+                 'body': {'attachmentId': 'att1', 'size': 250000}},
+            ]}
+        elif kind == 'quoted':
+            text = f"{plain}\n\n{_quoted_history(rng, rng.randint(2, 6))}"
+            quoted_html = html + f'<div class="gmail_quote"><blockquote>{"<p>old reply</p>" * 200}</blockquote></div></body></html>'
+            payload = {'mimeType': 'multipart/alternative', 'parts': [
+                {'mimeType': 'text/plain', 'body': {'data': _b64(text)}},
+                {'mimeType': 'text/html', 'body': {'data': _b64(quoted_html)}},
+            ]}
+        else:
+            text = (f"{plain}\n-- \n{name} Smith\nSenior Analyst | Example Corp\n+1 555 0100\n\n"
+                    f"From: Pandora <pandora@example.com>\nSent: Monday, January 1, 2024 9:00 AM\n"
+                    f"To: {name} <tenant@example.com>\nSubject: RE: Listing\n\n"
+                    + "Thank you for reaching out about the listing. " * 40)
+            payload = {'mimeType': 'multipart/alternative', 'parts': [
+                {'mimeType': 'text/html', 'body': {'data': _b64(html.replace('\n', '<br>') + '</body></html>')}},
+                {'mimeType': 'text/plain',
+                 'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="windows-1252"'}],
+                 'body': {'data': _b64(text, 'windows-1252')}},
+            ]}
+        payloads.append((kind, payload))
+    return payloads
@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from settings import get_config
+
+# --- CONFIGURATION ---
+DEFAULT_BACKEND = "sqlite"
+HISTORY_DB_PATH = "conversation_history.db"
+LEGACY_JSON_PATH = "conversation_history.json"
+SUMMARY_JSON_PATH = "conversation_summaries.json"
+# Keep only the last 5 conversations per sender to manage context length.
+DEFAULT_MAX_ENTRIES = 5
+
+
+class SqliteConversationStore:
+    """Per-sender conversation history in SQLite (WAL mode).
+
+    Appends are single-row inserts and lookups use the (sender, id) index, so
+    neither depends on the total amount of stored history. WAL lets readers
+    run alongside a writer, and every thread gets its own connection, so
+    concurrent workers and processes can share one database file.
+    """
+
+    def __init__(self, path=HISTORY_DB_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 legacy_json_path=LEGACY_JSON_PATH):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    incoming TEXT NOT NULL,
+                    outgoing TEXT NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS conversations_sender ON conversations (sender, id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS summaries (
+                    sender TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    updated TEXT NOT NULL
+                )""")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_json_path:
+            self.migrate_json(legacy_json_path)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sender_email):
+        """Return the sender's most recent conversations, oldest first."""
+        query = "SELECT timestamp, incoming, outgoing FROM conversations WHERE sender = ? ORDER BY id DESC"
+        params = [sender_email]
+        if self.max_entries:
+            query += " LIMIT ?"
+            params.append(self.max_entries)
+        rows = self._connect().execute(query, params).fetchall()
+        return [{'timestamp': t, 'incoming': i, 'outgoing': o} for t, i, o in reversed(rows)]
+
+    def load_summary(self, sender_email):
+        """Return the sender's rolling summary, or "" if none has been stored."""
+        row = self._connect().execute(
+            "SELECT summary FROM summaries WHERE sender = ?", (sender_email,)).fetchone()
+        return row[0] if row else ""
+
+    def append(self, sender_email, email_body, reply, timestamp=None, summarize=None):
+        """Record one exchange and drop entries beyond max_entries.
+
+        summarize(summary, email_body, reply, timestamp), if given, folds each
+        dropped exchange into the sender's rolling summary, so the summary
+        covers exactly what load() no longer returns. It runs inside the same
+        write transaction, so concurrent appends for one sender can't lose
+        each other's updates.
+        """
+        timestamp = timestamp or datetime.now().isoformat()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO conversations (sender, timestamp, incoming, outgoing) VALUES (?, ?, ?, ?)",
+                (sender_email, timestamp, email_body, reply))
+            if not self.max_entries:
+                return
+            dropped = conn.execute("""
+                SELECT id, timestamp, incoming, outgoing FROM conversations WHERE sender = ?
+                ORDER BY id DESC LIMIT -1 OFFSET ?""", (sender_email, self.max_entries)).fetchall()[::-1]
+            if not dropped:
+                return
+            if summarize is not None:
+                row = conn.execute("SELECT summary FROM summaries WHERE sender = ?", (sender_email,)).fetchone()
+                summary = row[0] if row else ""
+                for _, dropped_timestamp, incoming, outgoing in dropped:
+                    summary = summarize(summary, incoming, outgoing, dropped_timestamp)
+                conn.execute(
+                    "INSERT OR REPLACE INTO summaries (sender, summary, updated) VALUES (?, ?, ?)",
+                    (sender_email, summary, timestamp))
+            conn.execute("DELETE FROM conversations WHERE sender = ? AND id <= ?", (sender_email, dropped[-1][0]))
+
+    def migrate_json(self, json_path=LEGACY_JSON_PATH):
+        """Import a conversation_history.json file once; returns the number of entries copied."""
+        if not os.path.exists(json_path):
+            return 0
+        with self._connect() as conn:
+            # Take the write lock up front so two processes cannot both import the file.
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+                return 0
+            with open(json_path, 'r') as f:
+                history = json.load(f)
+            rows = [(sender, entry.get('timestamp', ''), entry.get('incoming', ''), entry.get('outgoing', ''))
+                    for sender, entries in history.items() for entry in entries]
+            conn.executemany(
+                "INSERT INTO conversations (sender, timestamp, incoming, outgoing) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)",
+                         (os.path.abspath(json_path),))
+        print(f"Migrated {len(rows)} conversation entries from {json_path} to {self.path}.")
+        return len(rows)
+
+
+class JsonConversationStore:
+    """The original single-file JSON history, kept for compatibility."""
+
+    def __init__(self, path=LEGACY_JSON_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 summary_path=SUMMARY_JSON_PATH):
+        self.path = path
+        self.max_entries = max_entries
+        # Summaries live in their own file so the history file keeps its original shape.
+        self.summary_path = summary_path
+        self._lock = threading.Lock()
+
+    def _read(self, path=None):
+        try:
+            with open(path or self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def load(self, sender_email):
+        with self._lock:
+            return self._read().get(sender_email, [])
+
+    def load_summary(self, sender_email):
+        with self._lock:
+            return self._read(self.summary_path).get(sender_email, "")
+
+    def append(self, sender_email, email_body, reply, timestamp=None, summarize=None):
+        timestamp = timestamp or datetime.now().isoformat()
+        with self._lock:
+            history = self._read()
+            entries = history.setdefault(sender_email, [])
+            entries.append({
+                'timestamp': timestamp,
+                'incoming': email_body,
+                'outgoing': reply
+            })
+            if self.max_entries:
+                dropped = entries[:-self.max_entries]
+                history[sender_email] = entries[-self.max_entries:]
+                if dropped and summarize is not None:
+                    summaries = self._read(self.summary_path)
+                    summary = summaries.get(sender_email, "")
+                    for entry in dropped:
+                        summary = summarize(summary, entry['incoming'], entry['outgoing'], entry['timestamp'])
+                    summaries[sender_email] = summary
+                    with open(self.summary_path, 'w') as f:
+                        json.dump(summaries, f, indent=2)
+            with open(self.path, 'w') as f:
+                json.dump(history, f, indent=2)
+
+
+def _sqlite_store(config):
+    return SqliteConversationStore(
+        path=config.get('history_db_path', HISTORY_DB_PATH),
+        max_entries=config.get('history_max_entries', DEFAULT_MAX_ENTRIES),
+        legacy_json_path=config.get('history_json_path', LEGACY_JSON_PATH))
+
+def _json_store(config):
+    return JsonConversationStore(
+        path=config.get('history_json_path', LEGACY_JSON_PATH),
+        max_entries=config.get('history_max_entries', DEFAULT_MAX_ENTRIES),
+        summary_path=config.get('history_summary_path', SUMMARY_JSON_PATH))
+
+def _firestore_store(config):
+    from firestore_context import get_context_provider, create_provider
+    return get_context_provider() or create_provider(config)
+
+# Backend name (config "conversation_store") -> factory taking the config dict.
+BACKENDS = {
+    'sqlite': _sqlite_store,
+    'json': _json_store,
+    'firestore': _firestore_store,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_store(config):
+    # context_backend "firestore" moves history to Firestore too unless overridden.
+    default = 'firestore' if config.get('context_backend') == 'firestore' else DEFAULT_BACKEND
+    backend = config.get('conversation_store', default)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown conversation_store backend: {backend}")
+    return BACKENDS[backend](config)
+
+def get_store():
+    """Return the process-wide conversation store, created from config.json on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = get_config()
+                _store = create_store(config)
+    return _store
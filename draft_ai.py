@@ -1,8 +1,10 @@
 import os
-import json
+import argparse
 import base64
-from email.mime.text import MIMEText
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
+from email.mime.text import MIMEText
 import re
 
 from google.oauth2.credentials import Credentials
@@ -10,22 +12,32 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
-from google.oauth2 import service_account
 
-import vertexai
-from vertexai.generative_models import GenerativeModel
-import pandas as pd
+from batch_prediction import (BacklogCheckpoint, BatchJobFailed, write_requests, read_results, run_local, submit_vertex, wait_vertex,
+                              CHECKPOINT_PATH, BATCH_DIR, DEFAULT_POLL_INTERVAL as BATCH_POLL_INTERVAL)
+from conversation_store import get_store
+from gemini_client import MODEL_NAME, generate_content, stream_content, print_latency_summary
+from firestore_context import get_context_provider
+from gmail_client import (fetch_unread_emails, thread_http, add_reply_headers, group_by_thread, mark_read, ReadMarker,
+                          DEFAULT_BATCH_SIZE, DEFAULT_MAX_CONCURRENCY)
+from gmail_sync import (poll_new_emails, load_sync_state, save_sync_state,
+                        SYNC_STATE_PATH, DEFAULT_FULL_RESYNC_INTERVAL)
+from metrics import instrument, timed, count_error, start_metrics_server, write_run_summary, RUN_SUMMARY_PATH
+from rate_limit import execute, print_throttle_summary, CircuitOpenError
+from settings import load_config, use_config
+from triage import get_triage, light_options, print_triage_summary, SKIP, LIGHT, FULL, TEMPLATE_REPLY
+from processing_ledger import get_ledger, reached, GENERATED, SAVED, DELIVERED, DONE
+from pipeline import drain_queue, run_forever, stage_limits, DEFAULT_MAX_WORKERS, DEFAULT_POLL_INTERVAL
+from property_catalog import get_property_context, catalog_fingerprint
+from property_index import retrieve_property_context, DEFAULT_TOP_K
+from prompt_builder import build_prompt, update_summary, DEFAULT_TOKEN_BUDGET
+from reply_cache import get_cache, print_cache_summary
 
 # --- CONFIGURATION ---
 GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.modify', 'https://www.googleapis.com/auth/gmail.compose']
-CONFIG_PATH = "config.json"
 TOKEN_PATH = "token.json"
 
 
-def load_config():
-    with open(CONFIG_PATH, "r") as f:
-        return json.load(f)
-
 def gmail_authenticate(client_secret):
     creds = None
     if os.path.exists(TOKEN_PATH):
@@ -41,45 +53,26 @@ def gmail_authenticate(client_secret):
             token.write(creds.to_json())
     return build('gmail', 'v1', credentials=creds)
 
-def get_unread_emails(service, user_id='me'):
+@instrument('get_unread_emails')
+def get_unread_emails(service, user_id='me', batch_size=DEFAULT_BATCH_SIZE,
+                      max_concurrency=DEFAULT_MAX_CONCURRENCY):
     try:
-        results = service.users().messages().list(userId=user_id, labelIds=['CATEGORY_PERSONAL'], q="is:unread").execute()
-        messages = results.get('messages', [])
-        emails = []
-        for msg in messages:
-            msg_data = service.users().messages().get(userId=user_id, id=msg['id']).execute()
-            payload = msg_data['payload']
-            headers = payload['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "")
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), "")
-            body = ""
-            if 'data' in payload.get('body', {}):
-                body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-            else:
-                for part in payload.get('parts', []):
-                    if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                        body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                        break
-            emails.append({
-                'id': msg['id'],
-                'subject': subject,
-                'sender': sender,
-                'body': body
-            })
-        return emails
-    except HttpError as error:
+        return fetch_unread_emails(service, user_id=user_id, batch_size=batch_size,
+                                   max_concurrency=max_concurrency)
+    except (HttpError, CircuitOpenError) as error:
+        count_error('get_unread_emails')
         print(f'An error occurred: {error}')
         return []
 
-def load_property_data(excel_path="Properties Listing.xlsx"):
+@instrument('load_property_data')
+def load_property_data(excel_path="Properties Listing.xlsx", query=None, top_k=DEFAULT_TOP_K):
     try:
-        df = pd.read_excel(excel_path)
-        property_info = "PROPERTY INFORMATION:\n"
-        for i, (index, row) in enumerate(df.iterrows()):
-            property_info += f"\nProperty {i + 1}:\n"
-            for column, value in row.items():
-                property_info += f"  {column}: {value}\n"
-        return property_info
+        provider = get_context_provider()
+        if provider is not None:
+            return provider.get_property_context(query=query, top_k=top_k)
+        if query and top_k:
+            return retrieve_property_context(query, top_k=top_k, path=excel_path)
+        return get_property_context(excel_path)
     except FileNotFoundError:
         print(f"Warning: {excel_path} not found. Running without property context.")
         return ""
@@ -87,47 +80,23 @@ def load_property_data(excel_path="Properties Listing.xlsx"):
         print(f"Error loading property data: {e}")
         return ""
 
+@instrument('load_conversation_history')
 def load_conversation_history(sender_email):
-    try:
-        with open('conversation_history.json', 'r') as f:
-            history = json.load(f)
-        return history.get(sender_email, [])
-    except FileNotFoundError:
-        return []
+    return get_store().load(sender_email)
+
+def sender_address(sender):
+    return sender.split('<')[1].split('>')[0] if '<' in sender else sender
 
 def save_conversation_history(sender_email, email_body, reply):
-    try:
-        with open('conversation_history.json', 'r') as f:
-            history = json.load(f)
-    except FileNotFoundError:
-        history = {}
-    if sender_email not in history:
-        history[sender_email] = []
-    history[sender_email].append({
-        'timestamp': datetime.now().isoformat(),
-        'incoming': email_body,
-        'outgoing': reply
-    })
-    history[sender_email] = history[sender_email][-5:]
-    with open('conversation_history.json', 'w') as f:
-        json.dump(history, f, indent=2)
-
-def generate_reply_with_gemini(project, location, email_body, sender_email):
-    config = load_config()
-    credentials = service_account.Credentials.from_service_account_file(
-        config['service_account_key'],
-        scopes=['https://www.googleapis.com/auth/cloud-platform']
-    )
-    vertexai.init(project=project, location=location, credentials=credentials)
-    model = GenerativeModel("gemini-2.0-flash-001")
-    property_context = load_property_data()
+    # Fold the exchange into the sender's rolling summary so older emails
+    # reach the prompt as a digest instead of raw text.
+    get_store().append(sender_email, email_body, reply, summarize=update_summary)
+
+def build_reply_prompt(email_body, sender_email, top_k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Assemble the reply prompt; returns (prompt, property_context, conversation_history)."""
+    property_context = load_property_data(query=email_body, top_k=top_k)
     conversation_history = load_conversation_history(sender_email)
-    history_context = ""
-    if conversation_history:
-        history_context = "\n\nPREVIOUS CONVERSATION HISTORY:\n"
-        for conv in conversation_history:
-            history_context += f"\nTenant: {conv['incoming'][:200]}...\n"
-            history_context += f"Pandora: {conv['outgoing'][:200]}...\n"
+    summary = get_store().load_summary(sender_email)
     system_prompt = """You are Pandora, an experienced and professional property manager. You have in-depth knowledge of each property you oversee, including amenities, lease terms, neighborhood features, and application procedures. Your tone is friendly, clear, and helpful. When composing replies, you:
 \t•\tGreet the sender by name (if provided)
 \t•\tThank them for their interest
@@ -135,49 +104,460 @@ def generate_reply_with_gemini(project, location, email_body, sender_email):
 \t•\tProvide any additional relevant details (availability, next steps, showing times)
 \t•\tInvite further questions and offer your contact information
 \t•\tReference previous conversations when relevant to provide continuity"""
-    user_prompt = f"""Below is an email from a prospective tenant asking questions about one of your listings. Read the message carefully and draft a warm, informative reply that addresses each question and guides them toward the next steps, do not include Re: in the beginning of the response.\n\n{property_context}{history_context}\n\nEmail from prospective tenant:\n{email_body}"""
-    full_prompt = f"{system_prompt}\n\n{user_prompt}"
-    response = model.generate_content(full_prompt)
-    return response.text
+    instructions = "Below is an email from a prospective tenant asking questions about one of your listings. Read the message carefully and draft a warm, informative reply that addresses each question and guides them toward the next steps, do not include Re: in the beginning of the response."
+    full_prompt, _ = build_prompt(system_prompt, instructions, email_body, property_context=property_context,
+                                  summary=summary, history=conversation_history, token_budget=token_budget)
+    return full_prompt, property_context, conversation_history
 
-def create_draft_email(service, to, subject, message_text, user_id='me'):
+@instrument('generate_reply_with_gemini')
+def generate_reply_with_gemini(project, location, email_body, sender_email, top_k=DEFAULT_TOP_K, use_cache=True,
+                              token_budget=DEFAULT_TOKEN_BUDGET, stream=False, model_name=MODEL_NAME):
+    full_prompt, property_context, conversation_history = build_reply_prompt(
+        email_body, sender_email, top_k=top_k, token_budget=token_budget)
+    # Follow-ups depend on the sender's own thread, so only first contacts use the cache.
+    cache = get_cache() if use_cache and not conversation_history else None
+    if cache is not None:
+        try:
+            cache.check_catalog(catalog_fingerprint())
+        except FileNotFoundError:
+            pass
+        cached = cache.get(email_body, property_context)
+        if cached is not None:
+            print("Using a cached reply for a repeated question.")
+            return cached
+    start = time.perf_counter()
+    if stream:
+        reply = stream_content(project, location, full_prompt, model_name=model_name)
+    else:
+        reply = generate_content(project, location, full_prompt, model_name=model_name).text
+    if cache is not None:
+        cache.put(email_body, property_context, reply, generation_seconds=time.perf_counter() - start)
+    return reply
+
+def _draft_body(to, subject, message_text, reply_to=None):
     message = MIMEText(message_text)
     message['to'] = to
     message['subject'] = "Re: " + subject
+    if reply_to is not None:
+        add_reply_headers(message, reply_to)
     raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
     body = {'message': {'raw': raw}}
-    draft = service.users().drafts().create(userId=user_id, body=body).execute()
+    if reply_to is not None:
+        body['message']['threadId'] = reply_to['thread_id']
+    return body
+
+@instrument('create_draft_email')
+def create_draft_email(service, to, subject, message_text, user_id='me', reply_to=None):
+    """Create a draft reply; pass the email being answered as reply_to to keep it in that Gmail thread."""
+    body = _draft_body(to, subject, message_text, reply_to=reply_to)
+    draft = execute(service.users().drafts().create(userId=user_id, body=body), 'drafts.create',
+                    http=thread_http(service))
     print(f"Draft created for {to} with subject '{subject}'")
     return draft
 
+@instrument('update_draft_email')
+def update_draft_email(service, draft_id, to, subject, message_text, user_id='me', reply_to=None):
+    body = dict(_draft_body(to, subject, message_text, reply_to=reply_to), id=draft_id)
+    return execute(service.users().drafts().update(userId=user_id, id=draft_id, body=body), 'drafts.update',
+                   http=thread_http(service))
+
+def write_draft(service, email, message_text, draft_id=None, ledger=None):
+    """Create the draft reply to `email`, or update draft_id when an earlier attempt left one behind.
+
+    With a ledger the new draft's ID is recorded against the email.
+    """
+    if draft_id:
+        try:
+            return update_draft_email(service, draft_id=draft_id, to=email['sender'], subject=email['subject'],
+                                      message_text=message_text, reply_to=email)
+        except HttpError as error:
+            if getattr(error.resp, 'status', None) != 404:
+                raise
+            # Deleted in Gmail since; start a fresh one.
+    draft = create_draft_email(service, to=email['sender'], subject=email['subject'], message_text=message_text,
+                               reply_to=email)
+    if ledger is not None:
+        ledger.set_draft(email['id'], draft['id'])
+    return draft
+
+@instrument('mark_as_read')
 def mark_as_read(service, msg_id, user_id='me'):
-    service.users().messages().modify(userId=user_id, id=msg_id, body={'removeLabelIds': ['UNREAD']}).execute()
+    request = service.users().messages().modify(userId=user_id, id=msg_id, body={'removeLabelIds': ['UNREAD']})
+    execute(request, 'messages.modify', http=thread_http(service))
+
+def build_stages(gmail_service, config, read_marker=None, ledger=None):
+    """Build the triage -> generate -> deliver pipeline that drafts replies.
+
+    With a ledger every email is claimed first and each finished step is
+    recorded, so an email picked up again after a crash continues from its
+    stored reply instead of generating or drafting twice.
+    """
+    limits = stage_limits(config)
+    stream = config.get('stream_replies', False)
+    # History writes that run alongside the Gmail draft.
+    background = ThreadPoolExecutor(max_workers=limits['generate'] + limits['deliver']) if stream else None
+    triage = get_triage() if config.get('triage', True) else None
+
+    def record(ctx, stage, **fields):
+        if ledger is not None:
+            ledger.complete(ctx['email']['id'], stage, **fields)
+
+    def mark_handled(email):
+        if read_marker is not None:
+            # The ledger hears about these when the marker flushes.
+            read_marker.add(email.get('ids', [email['id']]))
+        else:
+            mark_as_read(gmail_service, email['id'])
+            if ledger is not None:
+                ledger.finish([email['id']])
+
+    def claim(ctx):
+        email = ctx['email']
+        entry = ledger.claim(email['id'])
+        if entry is None:
+            print(f"Skipping email {email['id']}: already handled or claimed by another worker")
+            ctx['done'] = True
+            return
+        ctx['ledger'] = entry
+
+        def release():
+            # A background history write still in flight has to be recorded
+            # before the claim goes.
+            wait([ctx['history']] if 'history' in ctx else [])
+            ledger.release(email['id'], error=ctx.get('error'))
+
+        ctx['release'] = release
+
+    def classify(ctx):
+        ctx['triage'] = triage.classify(ctx['email'])
+
+    def generate(ctx):
+        email = ctx['email']
+        sender_email = sender_address(email['sender'])
+        entry = ctx.get('ledger')
+        if reached(entry, GENERATED):
+            # Generated before a restart; reuse it instead of calling Gemini again.
+            print(f"Resuming email from {email['sender']} at stage '{entry['stage']}'")
+            ctx['reply'] = entry['reply']
+            if not reached(entry, SAVED):
+                save_conversation_history(sender_email, email['body'], ctx['reply'])
+                record(ctx, SAVED)
+            return
+        decision = ctx.get('triage', {'route': FULL})
+        if decision['route'] == SKIP:
+            print(f"Skipping email from {email['sender']} ({decision['reason']})")
+            return
+        print(f"Processing email from {email['sender']} with subject '{email['subject']}'")
+
+        def save_history():
+            save_conversation_history(sender_email, email['body'], ctx['reply'])
+            record(ctx, SAVED)
+
+        options = {
+            'top_k': config.get('retrieval_top_k', DEFAULT_TOP_K),
+            'token_budget': config.get('prompt_token_budget', DEFAULT_TOKEN_BUDGET),
+        }
+        if decision['route'] == LIGHT:
+            options = light_options(config)
+        start = time.perf_counter()
+        if options is None:
+            ctx['reply'] = TEMPLATE_REPLY
+        else:
+            ctx['reply'] = generate_reply_with_gemini(
+                project=config['gcp_project'],
+                location=config['gcp_location'],
+                email_body=email['body'],
+                sender_email=sender_email,
+                use_cache=config.get('reply_cache', True),
+                stream=stream,
+                **options
+            )
+        if triage is not None:
+            triage.record_generation(decision['route'], time.perf_counter() - start)
+        record(ctx, GENERATED, reply=ctx['reply'], route=decision['route'])
+        if stream:
+            # Overlaps with the draft write; deliver() waits for it before marking read.
+            ctx['history'] = background.submit(save_history)
+        else:
+            save_history()
+
+    def deliver(ctx):
+        email = ctx['email']
+        if 'reply' not in ctx:
+            # Triaged as needing no reply; just clear it from the unread queue.
+            mark_handled(email)
+            return
+        entry = ctx.get('ledger')
+        if reached(entry, DELIVERED):
+            print(f"Draft for {email['sender']} was already created before a restart")
+        else:
+            # Drafts only ever hold a finished reply; an interrupted attempt's
+            # draft is updated rather than joined by a second one.
+            write_draft(gmail_service, email, ctx['reply'], draft_id=(entry or {}).get('draft_id'), ledger=ledger)
+            print(f"Draft created for sender: {email['sender']}")
+        if 'history' in ctx:
+            ctx['history'].result()
+        record(ctx, DELIVERED)
+        mark_handled(email)
+
+    stages = [
+        ('generate', generate, limits['generate']),
+        ('deliver', deliver, limits['deliver']),
+    ]
+    if triage is not None:
+        stages.insert(0, ('triage', classify, limits['triage']))
+    if ledger is not None:
+        stages.insert(0, ('claim', claim, limits['claim']))
+    return stages
+
+def run_backlog(gmail_service, config, runner=None, max_workers=DEFAULT_MAX_WORKERS, ledger=None):
+    """Answer the whole unread backlog with one batch job instead of a Gemini call per email.
+
+    Prompts for every pending email are written to a JSONL file and run as a
+    Vertex AI batch prediction job (runner "vertex", needs config
+    "backlog_gcs_uri") or by the local stand-in that reads and writes the
+    same format (runner "local"). Replies are then fanned out to drafts and
+    conversation history. The checkpoint file records the batch, the job and
+    every delivered draft, so rerunning after a crash picks up where it
+    stopped without generating anything twice.
+
+    With a ledger each email is claimed before delivery and its steps are
+    recorded there, so emails another run already answered are only marked
+    read, and a crash between drafting and checkpointing never drafts twice.
+    """
+    project, location = config['gcp_project'], config['gcp_location']
+    limits = stage_limits(config)
+    checkpoint_path = config.get('backlog_checkpoint_path', CHECKPOINT_PATH)
+    checkpoint = BacklogCheckpoint.load(checkpoint_path)
+    if checkpoint is not None:
+        print(f"Resuming the backlog run recorded in {checkpoint_path}.")
+    else:
+        emails = get_unread_emails(
+            gmail_service,
+            batch_size=config.get('gmail_batch_size', DEFAULT_BATCH_SIZE),
+            max_concurrency=config.get('gmail_max_concurrency', DEFAULT_MAX_CONCURRENCY)
+        )
+        if not emails:
+            print("No unread emails found.")
+            return
+        if config.get('triage', True):
+            # A batch job runs a single model, so LIGHT mail gets the full prompt too.
+            triage = get_triage()
+            skipped = {email['id'] for email in emails if triage.classify(email)['route'] == SKIP}
+            if skipped:
+                mark_read(gmail_service, skipped)
+                print(f"Marked {len(skipped)} emails that need no reply as read.")
+            emails = [email for email in emails if email['id'] not in skipped]
+        if ledger is not None:
+            stages = ledger.stages(email['id'] for email in emails)
+            answered = {key for key, stage in stages.items() if stage in (DELIVERED, DONE)}
+            if answered:
+                # Drafted by an earlier run that stopped before marking them read.
+                mark_read(gmail_service, answered)
+                ledger.finish(answered)
+                print(f"Marked {len(answered)} emails that already have a reply as read.")
+            emails = [email for email in emails if email['id'] not in answered]
+        if not emails:
+            print("No unread emails need a reply.")
+            return
+
+        def prompt_for(email):
+            prompt, _, _ = build_reply_prompt(
+                email['body'], sender_address(email['sender']),
+                top_k=config.get('retrieval_top_k', DEFAULT_TOP_K),
+                token_budget=config.get('prompt_token_budget', DEFAULT_TOKEN_BUDGET))
+            return email['id'], prompt
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            items = list(pool.map(prompt_for, emails))
+        batch_dir = config.get('backlog_dir', BATCH_DIR)
+        input_path = write_requests(
+            os.path.join(batch_dir, f"backlog-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl"), items)
+        checkpoint = BacklogCheckpoint(checkpoint_path)
+        checkpoint.update(
+            created=datetime.now().isoformat(),
+            runner=runner or config.get('backlog_runner') or ('vertex' if config.get('backlog_gcs_uri') else 'local'),
+            model=config.get('backlog_model', MODEL_NAME),
+            input_path=input_path,
+            emails={email['id']: email for email in emails},
+            job=None,
+            output_paths=[],
+            delivered=[],
+        )
+        print(f"Wrote {len(items)} prompts to {input_path}.")
+
+    state = checkpoint.state
+    if not state['output_paths']:
+        output_base = os.path.splitext(state['input_path'])[0] + "-output"
+        if state['runner'] == 'vertex':
+            if not state['job']:
+                checkpoint.update(job=submit_vertex(state['input_path'], project, location,
+                                                    config['backlog_gcs_uri'], model_name=state['model']))
+            try:
+                output_paths = wait_vertex(state['job'], project, location, output_base,
+                                           poll_interval=config.get('backlog_poll_interval', BATCH_POLL_INTERVAL))
+            except BatchJobFailed as e:
+                # Forget the dead job so the next --backlog resubmits the same prompts.
+                checkpoint.update(job=None)
+                count_error('batch_job')
+                print(f"{e}\nNo drafts were created and the emails stay unread; "
+                      f"run --backlog again to resubmit {state['input_path']}.")
+                return
+        else:
+            output_paths = run_local(state['input_path'], output_base + ".jsonl", project, location,
+                                     model_name=state['model'], max_workers=limits['generate'])
+        checkpoint.update(output_paths=output_paths)
+
+    replies = read_results(state['output_paths'], state['input_path'])
+    delivered = checkpoint.delivered()
+    pending = [email for key, email in state['emails'].items() if key not in delivered]
+
+    def deliver(ctx):
+        email = ctx['email']
+        entry = None
+        if ledger is not None:
+            entry = ledger.claim(email['id'])
+            if entry is None:
+                print(f"Skipping email {email['id']}: already handled or claimed by another worker")
+                return
+            ctx['release'] = lambda: ledger.release(email['id'], error=ctx.get('error'))
+        if not reached(entry, DELIVERED):
+            # A reply the ledger already holds may be in history or a draft; keep using it.
+            reply = entry['reply'] if reached(entry, GENERATED) else replies.get(email['id'])
+            if reply is None:
+                raise RuntimeError("the batch job returned no reply")
+            if ledger is not None and not reached(entry, GENERATED):
+                ledger.complete(email['id'], GENERATED, reply=reply)
+            if not reached(entry, SAVED):
+                save_conversation_history(sender_address(email['sender']), email['body'], reply)
+                if ledger is not None:
+                    ledger.complete(email['id'], SAVED)
+            write_draft(gmail_service, email, reply, draft_id=entry and entry['draft_id'], ledger=ledger)
+            if ledger is not None:
+                ledger.complete(email['id'], DELIVERED)
+        checkpoint.mark_delivered(email['id'])
+
+    if pending:
+        drain_queue(pending, [('deliver', deliver, limits['deliver'])], max_workers=max_workers)
+    # Emails without a reply stay unread for the next run.
+    delivered = checkpoint.delivered()
+    if delivered:
+        mark_read(gmail_service, delivered)
+        if ledger is not None:
+            ledger.finish(delivered)
+    print(f"Backlog done: {len(delivered)}/{len(state['emails'])} drafts created.")
+    checkpoint.remove()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Draft Gemini replies to unread property inquiries.")
+    parser.add_argument('--drain', action='store_true',
+                        help="process every unread email instead of only the newest one")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of emails processed concurrently in --drain and --daemon mode")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and poll Gmail history for new mail")
+    parser.add_argument('--poll-interval', type=float, default=None,
+                        help="seconds between polls in --daemon mode")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics on this local port")
+    parser.add_argument('--threads', action='store_true',
+                        help="answer each Gmail thread once and mark everything read with one batchModify")
+    parser.add_argument('--stream', action='store_true',
+                        help="stream Gemini replies, report time-to-first-token and write history alongside the draft")
+    parser.add_argument('--backlog', action='store_true',
+                        help="draft replies to every unread email with one batch prediction job")
+    parser.add_argument('--batch-runner', choices=('vertex', 'local'), default=None,
+                        help="run --backlog jobs on Vertex AI batch prediction or locally")
+    args = parser.parse_args(argv)
 
-def main():
     config = load_config()
+    use_config(config)
+    if args.stream:
+        config['stream_replies'] = True
+    metrics_port = args.metrics_port or config.get('metrics_port')
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    summary_path = config.get('metrics_summary_path', RUN_SUMMARY_PATH)
     gmail_service = gmail_authenticate(config['gmail_client_secret'])
-    emails = get_unread_emails(gmail_service)
-    if not emails:
-        print("No unread emails found.")
+    workers = args.workers or config.get('max_workers', DEFAULT_MAX_WORKERS)
+
+    ledger = get_ledger()
+    if args.backlog:
+        run_backlog(gmail_service, config, runner=args.batch_runner, max_workers=workers, ledger=ledger)
+        print_latency_summary()
+        print_throttle_summary()
+        print_triage_summary()
+        write_run_summary(summary_path)
         return
-    email = emails[0]
-    print(f"Processing email from {email['sender']} with subject '{email['subject']}'")
-    sender_email = email['sender'].split('<')[1].split('>')[0] if '<' in email['sender'] else email['sender']
-    reply = generate_reply_with_gemini(
-        project=config['gcp_project'],
-        location=config['gcp_location'],
-        email_body=email['body'],
-        sender_email=sender_email
-    )
-    save_conversation_history(sender_email, email['body'], reply)
-    create_draft_email(
+
+    thread_mode = args.threads or config.get('thread_mode', False)
+    read_marker = None
+    if thread_mode:
+        read_marker = ReadMarker(gmail_service, on_flush=ledger.finish if ledger is not None else None)
+    stages = build_stages(gmail_service, config, read_marker=read_marker, ledger=ledger)
+
+    if args.daemon:
+        state_path = config.get('sync_state_path', SYNC_STATE_PATH)
+        state = load_sync_state(state_path)
+        poll_interval = args.poll_interval or config.get('poll_interval', DEFAULT_POLL_INTERVAL)
+
+        def poll():
+            with timed('get_unread_emails'):
+                emails = poll_new_emails(
+                    gmail_service, state,
+                    batch_size=config.get('gmail_batch_size', DEFAULT_BATCH_SIZE),
+                    max_concurrency=config.get('gmail_max_concurrency', DEFAULT_MAX_CONCURRENCY),
+                    full_resync_interval=config.get('full_resync_interval', DEFAULT_FULL_RESYNC_INTERVAL)
+                )
+            return group_by_thread(emails) if thread_mode else emails
+
+        def on_drained():
+            if read_marker is not None:
+                read_marker.flush()
+            save_sync_state(state, state_path)
+
+        print(f"Watching for new mail every {poll_interval}s. Press Ctrl+C to stop.")
+        try:
+            run_forever(
+                poll=poll,
+                stages=stages,
+                on_drained=on_drained,
+                poll_interval=poll_interval,
+                max_workers=workers
+            )
+        except KeyboardInterrupt:
+            print("Stopped.")
+            if read_marker is not None:
+                read_marker.flush()
+            print_latency_summary()
+            print_throttle_summary()
+            print_triage_summary()
+            print_cache_summary()
+            write_run_summary(summary_path)
+        return
+
+    emails = get_unread_emails(
         gmail_service,
-        to=email['sender'],
-        subject=email['subject'],
-        message_text=reply
+        batch_size=config.get('gmail_batch_size', DEFAULT_BATCH_SIZE),
+        max_concurrency=config.get('gmail_max_concurrency', DEFAULT_MAX_CONCURRENCY)
     )
-    print(f"Draft created for sender: {email['sender']}")
-    mark_as_read(gmail_service, email['id'])
+    if not emails:
+        print("No unread emails found.")
+        return
+    if thread_mode:
+        emails = group_by_thread(emails)
+
+    if args.drain:
+        drain_queue(emails, stages, max_workers=workers)
+    else:
+        drain_queue(emails[:1], stages, max_workers=1)
+    if read_marker is not None:
+        read_marker.flush()
+    print_latency_summary()
+    print_throttle_summary()
+    print_triage_summary()
+    print_cache_summary()
+    write_run_summary(summary_path)
 
 if __name__ == "__main__":
     main()
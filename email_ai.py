@@ -1,30 +1,37 @@
 import os
-import json
+import argparse
+import time
 import base64
 from email.mime.text import MIMEText
-from datetime import datetime
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
-from google.oauth2 import service_account
 
-import vertexai
-from vertexai.generative_models import GenerativeModel
-import pandas as pd
+from conversation_store import get_store
+from gemini_client import MODEL_NAME, generate_content, print_latency_summary
+from firestore_context import get_context_provider
+from gmail_client import (fetch_unread_emails, thread_http, add_reply_headers, group_by_thread, ReadMarker,
+                          DEFAULT_BATCH_SIZE, DEFAULT_MAX_CONCURRENCY)
+from gmail_sync import (poll_new_emails, load_sync_state, save_sync_state,
+                        SYNC_STATE_PATH, DEFAULT_FULL_RESYNC_INTERVAL)
+from metrics import instrument, timed, count_error, start_metrics_server, write_run_summary, RUN_SUMMARY_PATH
+from rate_limit import execute, print_throttle_summary, CircuitOpenError
+from settings import load_config, use_config
+from triage import get_triage, light_options, print_triage_summary, SKIP, LIGHT, FULL, TEMPLATE_REPLY
+from processing_ledger import get_ledger, reached, GENERATED, SAVED, DELIVERED
+from pipeline import drain_queue, run_forever, stage_limits, DEFAULT_MAX_WORKERS, DEFAULT_POLL_INTERVAL
+from property_catalog import get_property_context
+from property_index import retrieve_property_context, DEFAULT_TOP_K
+from prompt_builder import build_prompt, update_summary, DEFAULT_TOKEN_BUDGET
 
 # --- CONFIGURATION ---
 GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.modify']
-CONFIG_PATH = "config.json"
 TOKEN_PATH = "token.json"
 
 
-def load_config():
-    with open(CONFIG_PATH, "r") as f:
-        return json.load(f)
-
 def gmail_authenticate(client_secret):
     creds = None
     if os.path.exists(TOKEN_PATH):
@@ -40,58 +47,46 @@ def gmail_authenticate(client_secret):
             token.write(creds.to_json())
     return build('gmail', 'v1', credentials=creds)
 
-def get_unread_emails(service, user_id='me'):
+@instrument('get_unread_emails')
+def get_unread_emails(service, user_id='me', batch_size=DEFAULT_BATCH_SIZE,
+                      max_concurrency=DEFAULT_MAX_CONCURRENCY):
     try:
-        results = service.users().messages().list(userId=user_id, labelIds=['CATEGORY_PERSONAL'], q="is:unread").execute()
-        messages = results.get('messages', [])
-        emails = []
-        for msg in messages:
-            msg_data = service.users().messages().get(userId=user_id, id=msg['id']).execute()
-            payload = msg_data['payload']
-            headers = payload['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "")
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), "")
-            body = ""
-            if 'data' in payload.get('body', {}):
-                body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-            else:
-                for part in payload.get('parts', []):
-                    if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                        body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                        break
-            emails.append({
-                'id': msg['id'],
-                'subject': subject,
-                'sender': sender,
-                'body': body
-            })
-        return emails
-    except HttpError as error:
+        return fetch_unread_emails(service, user_id=user_id, batch_size=batch_size,
+                                   max_concurrency=max_concurrency)
+    except (HttpError, CircuitOpenError) as error:
+        count_error('get_unread_emails')
         print(f'An error occurred: {error}')
         return []
 
+@instrument('mark_as_read')
 def mark_as_read(service, msg_id, user_id='me'):
-    service.users().messages().modify(userId=user_id, id=msg_id, body={'removeLabelIds': ['UNREAD']}).execute()
+    request = service.users().messages().modify(userId=user_id, id=msg_id, body={'removeLabelIds': ['UNREAD']})
+    execute(request, 'messages.modify', http=thread_http(service))
 
-def send_email(service, to, subject, message_text, user_id='me'):
+@instrument('send_email')
+def send_email(service, to, subject, message_text, user_id='me', reply_to=None):
+    """Send a reply; pass the email being answered as reply_to to keep it in that Gmail thread."""
     message = MIMEText(message_text)
     message['to'] = to
     message['subject'] = "Re: " + subject
+    if reply_to is not None:
+        add_reply_headers(message, reply_to)
     raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
     body = {'raw': raw}
-    service.users().messages().send(userId=user_id, body=body).execute()
+    if reply_to is not None:
+        body['threadId'] = reply_to['thread_id']
+    execute(service.users().messages().send(userId=user_id, body=body), 'messages.send', http=thread_http(service))
 
-def load_property_data(excel_path="Properties Listing.xlsx"):
-    """Load property information from Excel file."""
+@instrument('load_property_data')
+def load_property_data(excel_path="Properties Listing.xlsx", query=None, top_k=DEFAULT_TOP_K):
+    """Load property information from Excel file, limited to the top_k listings most relevant to query."""
     try:
-        df = pd.read_excel(excel_path)
-        # Convert DataFrame to a formatted string
-        property_info = "PROPERTY INFORMATION:\n"
-        for i, (index, row) in enumerate(df.iterrows()):
-            property_info += f"\nProperty {i + 1}:\n"
-            for column, value in row.items():
-                property_info += f"  {column}: {value}\n"
-        return property_info
+        provider = get_context_provider()
+        if provider is not None:
+            return provider.get_property_context(query=query, top_k=top_k)
+        if query and top_k:
+            return retrieve_property_context(query, top_k=top_k, path=excel_path)
+        return get_property_context(excel_path)
     except FileNotFoundError:
         print(f"Warning: {excel_path} not found. Running without property context.")
         return ""
@@ -99,61 +94,24 @@ def load_property_data(excel_path="Properties Listing.xlsx"):
         print(f"Error loading property data: {e}")
         return ""
 
+@instrument('load_conversation_history')
 def load_conversation_history(sender_email):
     """Load previous conversation history for a sender."""
-    try:
-        with open('conversation_history.json', 'r') as f:
-            history = json.load(f)
-        return history.get(sender_email, [])
-    except FileNotFoundError:
-        return []
+    return get_store().load(sender_email)
 
 def save_conversation_history(sender_email, email_body, reply):
     """Save conversation to history."""
-    try:
-        with open('conversation_history.json', 'r') as f:
-            history = json.load(f)
-    except FileNotFoundError:
-        history = {}
-    
-    if sender_email not in history:
-        history[sender_email] = []
-    
-    history[sender_email].append({
-        'timestamp': datetime.now().isoformat(),
-        'incoming': email_body,
-        'outgoing': reply
-    })
-    
-    # Keep only last 5 conversations to manage context length
-    history[sender_email] = history[sender_email][-5:]
-    
-    with open('conversation_history.json', 'w') as f:
-        json.dump(history, f, indent=2)
+    # Fold the exchange into the sender's rolling summary so older emails
+    # reach the prompt as a digest instead of raw text.
+    get_store().append(sender_email, email_body, reply, summarize=update_summary)
 
-def generate_reply_with_gemini(project, location, email_body, sender_email):
-    # Load service account credentials explicitly
-    config = load_config()
-    credentials = service_account.Credentials.from_service_account_file(
-        config['service_account_key'],
-        scopes=['https://www.googleapis.com/auth/cloud-platform']
-    )
-    
-    vertexai.init(project=project, location=location, credentials=credentials)
-    model = GenerativeModel("gemini-2.0-flash-001")
-    
+@instrument('generate_reply_with_gemini')
+def generate_reply_with_gemini(project, location, email_body, sender_email, top_k=DEFAULT_TOP_K,
+                              token_budget=DEFAULT_TOKEN_BUDGET, model_name=MODEL_NAME):
     # Load property context and conversation history
-    property_context = load_property_data()
+    property_context = load_property_data(query=email_body, top_k=top_k)
     conversation_history = load_conversation_history(sender_email)
-    
-    # Format conversation history
-    history_context = ""
-    if conversation_history:
-        history_context = "\n\nPREVIOUS CONVERSATION HISTORY:\n"
-        for conv in conversation_history:
-            history_context += f"\nTenant: {conv['incoming'][:200]}...\n"
-            history_context += f"Pandora: {conv['outgoing'][:200]}...\n"
-    
+    summary = get_store().load_summary(sender_email)
     system_prompt = """You are Pandora, an experienced and professional property manager. You have in-depth knowledge of each property you oversee, including amenities, lease terms, neighborhood features, and application procedures. Your tone is friendly, clear, and helpful. When composing replies, you should:
 	•	Write a concise, natural subject line (no “Re:” prefixes and do not include “Subject:” in the body).
 	•	Greet the sender by name (if provided).
@@ -163,51 +121,218 @@ def generate_reply_with_gemini(project, location, email_body, sender_email):
 	•	Invite further questions and provide your contact information.
 """
     
-    user_prompt = f"""You are Pandora, the property manager. Below is an email from a prospective tenant asking questions about one of your listings. Draft a warm, informative reply with an organic subject line (no “Re:” prefix) and no explicit “Subject:” label inside the email body:
-
-{property_context}{history_context}
-
-Email from prospective tenant:
-{email_body}"""
+    instructions = "You are Pandora, the property manager. Below is an email from a prospective tenant asking questions about one of your listings. Draft a warm, informative reply with an organic subject line (no “Re:” prefix) and no explicit “Subject:” label inside the email body:"
     
-    # Combine system and user prompts
-    full_prompt = f"{system_prompt}\n\n{user_prompt}"
-    response = model.generate_content(full_prompt)
+    # Fit listings, history and the email into the token budget
+    full_prompt, _ = build_prompt(system_prompt, instructions, email_body, property_context=property_context,
+                                  summary=summary, history=conversation_history, token_budget=token_budget)
+    response = generate_content(project, location, full_prompt, model_name=model_name)
     return response.text
 
-def main():
+def build_stages(gmail_service, config, read_marker=None, ledger=None):
+    """Split the reply flow into Gemini generation and Gmail delivery stages.
+
+    With a read_marker (thread mode) delivered messages are collected for
+    one batchModify instead of being marked read one by one. Unless config
+    "triage" is false, a triage stage first decides whether each email is
+    skipped, answered cheaply or given the full prompt. With a ledger each
+    email is claimed before anything else and every finished step is
+    recorded, so a restart resumes from the stored reply and never sends
+    the same reply twice.
+    """
+    limits = stage_limits(config)
+    triage = get_triage() if config.get('triage', True) else None
+
+    def record(ctx, stage, **fields):
+        if ledger is not None:
+            ledger.complete(ctx['email']['id'], stage, **fields)
+
+    def mark_handled(email):
+        if read_marker is not None:
+            # The ledger hears about these when the marker flushes.
+            read_marker.add(email.get('ids', [email['id']]))
+        else:
+            mark_as_read(gmail_service, email['id'])
+            if ledger is not None:
+                ledger.finish([email['id']])
+
+    def claim(ctx):
+        email = ctx['email']
+        entry = ledger.claim(email['id'])
+        if entry is None:
+            print(f"Skipping email {email['id']}: already handled or claimed by another worker")
+            ctx['done'] = True
+            return
+        ctx['ledger'] = entry
+        ctx['release'] = lambda: ledger.release(email['id'], error=ctx.get('error'))
+
+    def classify(ctx):
+        ctx['triage'] = triage.classify(ctx['email'])
+
+    def generate(ctx):
+        email = ctx['email']
+        # Extract email address from sender
+        sender_email = email['sender'].split('<')[1].split('>')[0] if '<' in email['sender'] else email['sender']
+        entry = ctx.get('ledger')
+        if reached(entry, GENERATED):
+            # Generated before a restart; reuse it instead of calling Gemini again.
+            print(f"Resuming email from {email['sender']} at stage '{entry['stage']}'")
+            ctx['reply'] = entry['reply']
+            if not reached(entry, SAVED):
+                save_conversation_history(sender_email, email['body'], ctx['reply'])
+                record(ctx, SAVED)
+            return
+        decision = ctx.get('triage', {'route': FULL})
+        if decision['route'] == SKIP:
+            print(f"Skipping email from {email['sender']} ({decision['reason']})")
+            return
+        print(f"Processing email from {email['sender']} with subject '{email['subject']}'")
+        options = {
+            'top_k': config.get('retrieval_top_k', DEFAULT_TOP_K),
+            'token_budget': config.get('prompt_token_budget', DEFAULT_TOKEN_BUDGET),
+        }
+        if decision['route'] == LIGHT:
+            options = light_options(config)
+        start = time.perf_counter()
+        if options is None:
+            ctx['reply'] = TEMPLATE_REPLY
+        else:
+            ctx['reply'] = generate_reply_with_gemini(
+                project=config['gcp_project'],
+                location=config['gcp_location'],
+                email_body=email['body'],
+                sender_email=sender_email,
+                **options
+            )
+        if triage is not None:
+            triage.record_generation(decision['route'], time.perf_counter() - start)
+        record(ctx, GENERATED, reply=ctx['reply'], route=decision['route'])
+        # Save conversation to history
+        save_conversation_history(sender_email, email['body'], ctx['reply'])
+        record(ctx, SAVED)
+
+    def deliver(ctx):
+        email = ctx['email']
+        if 'reply' not in ctx:
+            # Triaged as needing no reply; just clear it from the unread queue.
+            mark_handled(email)
+            return
+        if reached(ctx.get('ledger'), DELIVERED):
+            print(f"Reply to {email['sender']} was already sent before a restart")
+        else:
+            send_email(
+                gmail_service,
+                to=email['sender'],
+                subject=email['subject'],
+                message_text=ctx['reply'],
+                reply_to=email
+            )
+            record(ctx, DELIVERED)
+        mark_handled(email)
+        print(f"Replied to {email['sender']}.")
+
+    stages = [
+        ('generate', generate, limits['generate']),
+        ('deliver', deliver, limits['deliver']),
+    ]
+    if triage is not None:
+        stages.insert(0, ('triage', classify, limits['triage']))
+    if ledger is not None:
+        stages.insert(0, ('claim', claim, limits['claim']))
+    return stages
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reply to unread property inquiries with Gemini.")
+    parser.add_argument('--drain', action='store_true',
+                        help="process every unread email instead of only the newest one")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of emails processed concurrently in --drain and --daemon mode")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and poll Gmail history for new mail")
+    parser.add_argument('--poll-interval', type=float, default=None,
+                        help="seconds between polls in --daemon mode")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics on this local port")
+    parser.add_argument('--threads', action='store_true',
+                        help="answer each Gmail thread once and mark everything read with one batchModify")
+    args = parser.parse_args(argv)
+
     config = load_config()
+    use_config(config)
+    metrics_port = args.metrics_port or config.get('metrics_port')
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    summary_path = config.get('metrics_summary_path', RUN_SUMMARY_PATH)
     gmail_service = gmail_authenticate(config['gmail_client_secret'])
-    emails = get_unread_emails(gmail_service)
-    if not emails:
-        print("No unread emails found.")
+    thread_mode = args.threads or config.get('thread_mode', False)
+    ledger = get_ledger()
+    read_marker = None
+    if thread_mode:
+        read_marker = ReadMarker(gmail_service, on_flush=ledger.finish if ledger is not None else None)
+    stages = build_stages(gmail_service, config, read_marker=read_marker, ledger=ledger)
+    workers = args.workers or config.get('max_workers', DEFAULT_MAX_WORKERS)
+
+    if args.daemon:
+        state_path = config.get('sync_state_path', SYNC_STATE_PATH)
+        state = load_sync_state(state_path)
+        poll_interval = args.poll_interval or config.get('poll_interval', DEFAULT_POLL_INTERVAL)
+
+        def poll():
+            with timed('get_unread_emails'):
+                emails = poll_new_emails(
+                    gmail_service, state,
+                    batch_size=config.get('gmail_batch_size', DEFAULT_BATCH_SIZE),
+                    max_concurrency=config.get('gmail_max_concurrency', DEFAULT_MAX_CONCURRENCY),
+                    full_resync_interval=config.get('full_resync_interval', DEFAULT_FULL_RESYNC_INTERVAL)
+                )
+            return group_by_thread(emails) if thread_mode else emails
+
+        def on_drained():
+            if read_marker is not None:
+                read_marker.flush()
+            save_sync_state(state, state_path)
+
+        print(f"Watching for new mail every {poll_interval}s. Press Ctrl+C to stop.")
+        try:
+            run_forever(
+                poll=poll,
+                stages=stages,
+                on_drained=on_drained,
+                poll_interval=poll_interval,
+                max_workers=workers
+            )
+        except KeyboardInterrupt:
+            print("Stopped.")
+            if read_marker is not None:
+                read_marker.flush()
+            print_latency_summary()
+            print_throttle_summary()
+            print_triage_summary()
+            write_run_summary(summary_path)
         return
 
-    # Only process the first unread email
-    email = emails[0]
-    print(f"Processing email from {email['sender']} with subject '{email['subject']}'")
-    
-    # Extract email address from sender
-    sender_email = email['sender'].split('<')[1].split('>')[0] if '<' in email['sender'] else email['sender']
-    
-    reply = generate_reply_with_gemini(
-        project=config['gcp_project'],
-        location=config['gcp_location'],
-        email_body=email['body'],
-        sender_email=sender_email
-    )
-    
-    # Save conversation to history
-    save_conversation_history(sender_email, email['body'], reply)
-    
-    send_email(
+    emails = get_unread_emails(
         gmail_service,
-        to=email['sender'],
-        subject=email['subject'],
-        message_text=reply
+        batch_size=config.get('gmail_batch_size', DEFAULT_BATCH_SIZE),
+        max_concurrency=config.get('gmail_max_concurrency', DEFAULT_MAX_CONCURRENCY)
     )
-    mark_as_read(gmail_service, email['id'])
-    print(f"Replied to {email['sender']}.")
+    if not emails:
+        print("No unread emails found.")
+        return
+    if thread_mode:
+        emails = group_by_thread(emails)
+
+    if args.drain:
+        drain_queue(emails, stages, max_workers=workers)
+    else:
+        # Only process the first unread email
+        drain_queue(emails[:1], stages, max_workers=1)
+    if read_marker is not None:
+        read_marker.flush()
+    print_latency_summary()
+    print_throttle_summary()
+    print_triage_summary()
+    write_run_summary(summary_path)
 
 if __name__ == "__main__":
     main()
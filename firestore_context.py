@@ -0,0 +1,270 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+from property_catalog import render_property_context
+from property_index import PropertyIndex, DEFAULT_TOP_K
+from settings import get_config
+
+# --- CONFIGURATION ---
+PROPERTIES_COLLECTION = "properties"
+CONVERSATIONS_COLLECTION = "conversations"
+MESSAGES_SUBCOLLECTION = "messages"
+# Written by upload_to_firestore.py on every property document
+CONTENT_HASH_FIELD = "_content_hash"
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_SENDERS = 10000
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_MAX_ENTRIES = 5
+
+
+class TtlLruCache:
+    """Thread-safe mapping with per-entry expiry and least-recently-used eviction."""
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_SENDERS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class FirestoreContextProvider:
+    """Serves listings and per-sender history from Firestore through a local cache.
+
+    Properties are read once into a DataFrame (plus retrieval index) and
+    reused until Firestore reports a change. Sender histories are cached per
+    sender with TTL/LRU eviction. Invalidation uses snapshot listeners on the
+    properties and conversations collections when available; otherwise a
+    background thread polls the properties' content hashes and history
+    entries simply expire after `ttl` seconds. Writes from this replica
+    update the local cache directly.
+
+    History lives in conversations/{sender}/messages, one document per
+    exchange; the parent document holds the rolling summary and the
+    last_updated field other replicas' listeners react to. An append writes
+    both in one transaction, so replicas updating the same sender's summary
+    retry instead of overwriting each other.
+    """
+
+    def __init__(self, db, ttl=DEFAULT_TTL_SECONDS, max_senders=DEFAULT_MAX_SENDERS,
+                 max_entries=DEFAULT_MAX_ENTRIES, use_listeners=True, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.db = db
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self.history_cache = TtlLruCache(ttl=ttl, max_entries=max_senders)
+        self.summary_cache = TtlLruCache(ttl=ttl, max_entries=max_senders)
+        self._lock = threading.Lock()
+        self._properties = None
+        self._properties_fingerprint = None
+        self._watches = []
+        self._stop = threading.Event()
+        if use_listeners and self._start_listeners():
+            return
+        threading.Thread(target=self._poll_properties, daemon=True).start()
+
+    # --- invalidation ---
+    def _start_listeners(self):
+        try:
+            self._watches.append(self.db.collection(PROPERTIES_COLLECTION).on_snapshot(self._on_properties_changed))
+            self._watches.append(self.db.collection(CONVERSATIONS_COLLECTION).on_snapshot(self._on_conversations_changed))
+            return True
+        except Exception as e:
+            print(f"Firestore listeners unavailable ({e}); falling back to polling every {self.poll_interval}s.")
+            self._unsubscribe()
+            return False
+
+    def _on_properties_changed(self, snapshots, changes, read_time):
+        if changes:
+            self.invalidate_properties()
+
+    def _on_conversations_changed(self, snapshots, changes, read_time):
+        for change in changes:
+            self.history_cache.invalidate(change.document.id)
+            self.summary_cache.invalidate(change.document.id)
+
+    def _properties_fingerprint_remote(self):
+        snapshots = self.db.collection(PROPERTIES_COLLECTION).select([CONTENT_HASH_FIELD]).stream()
+        return tuple(sorted((s.id, (s.to_dict() or {}).get(CONTENT_HASH_FIELD)) for s in snapshots))
+
+    def _poll_properties(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self._properties is not None and self._properties_fingerprint_remote() != self._properties_fingerprint:
+                    self.invalidate_properties()
+            except Exception as e:
+                print(f"Polling Firestore properties failed: {e}")
+
+    def invalidate_properties(self):
+        with self._lock:
+            self._properties = None
+
+    def _unsubscribe(self):
+        for watch in self._watches:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                pass
+        self._watches = []
+
+    def close(self):
+        """Stop listeners and the polling thread."""
+        self._stop.set()
+        self._unsubscribe()
+
+    # --- properties ---
+    def _load_properties(self):
+        entry = self._properties
+        if entry is not None:
+            return entry
+        with self._lock:
+            if self._properties is None:
+                snapshots = sorted(self.db.collection(PROPERTIES_COLLECTION).stream(), key=lambda s: s.id)
+                records = [s.to_dict() or {} for s in snapshots]
+                self._properties_fingerprint = tuple((s.id, r.get(CONTENT_HASH_FIELD)) for s, r in zip(snapshots, records))
+                df = pd.DataFrame(records)
+                df = df.drop(columns=[CONTENT_HASH_FIELD], errors='ignore')
+                self._properties = (df, PropertyIndex(df))
+            return self._properties
+
+    def get_property_context(self, query=None, top_k=DEFAULT_TOP_K):
+        """Render the listings (top_k most relevant to query when given) as prompt context."""
+        df, index = self._load_properties()
+        if df.empty:
+            return ""
+        if query and top_k:
+            return render_property_context(df.iloc[index.search(query, top_k=top_k)])
+        return render_property_context(df)
+
+    # --- conversation history ---
+    def _conversation(self, sender_email):
+        return self.db.collection(CONVERSATIONS_COLLECTION).document(sender_email)
+
+    def load(self, sender_email):
+        """Return the sender's most recent exchanges, oldest first."""
+        history = self.history_cache.get(sender_email)
+        if history is None:
+            query = self._conversation(sender_email).collection(MESSAGES_SUBCOLLECTION).order_by(
+                'timestamp', direction='DESCENDING')
+            if self.max_entries:
+                query = query.limit(self.max_entries)
+            history = [{'timestamp': d.get('timestamp'), 'incoming': d.get('incoming'),
+                        'outgoing': d.get('outgoing')} for d in query.stream()][::-1]
+            self.history_cache.put(sender_email, history)
+        return list(history)
+
+    def load_summary(self, sender_email):
+        """Return the rolling summary stored on the sender's conversation document."""
+        summary = self.summary_cache.get(sender_email)
+        if summary is None:
+            snapshot = self._conversation(sender_email).get()
+            summary = ((snapshot.to_dict() or {}) if snapshot.exists else {}).get('summary', "")
+            self.summary_cache.put(sender_email, summary)
+        return summary
+
+    def append(self, sender_email, email_body, reply, timestamp=None, summarize=None):
+        """Add one exchange; summarize(summary, email_body, reply, timestamp) updates the rolling summary.
+
+        Only the exchange this append pushes out of the last max_entries is
+        folded in, so the summary covers what load() no longer returns. It is
+        read and rewritten in a Firestore transaction, so replicas appending
+        for the same sender don't overwrite each other.
+        """
+        entry = {
+            'timestamp': timestamp or datetime.now().isoformat(),
+            'incoming': email_body,
+            'outgoing': reply,
+        }
+        conversation = self._conversation(sender_email)
+        parent = {'email': sender_email, 'last_updated': entry['timestamp']}
+        if summarize is None:
+            conversation.collection(MESSAGES_SUBCOLLECTION).add(entry)
+            conversation.set(parent, merge=True)
+        else:
+            from google.cloud import firestore
+
+            messages = conversation.collection(MESSAGES_SUBCOLLECTION)
+
+            @firestore.transactional
+            def write(transaction):
+                snapshot = conversation.get(transaction=transaction)
+                summary = ((snapshot.to_dict() or {}) if snapshot.exists else {}).get('summary', "")
+                fields = dict(parent)
+                if self.max_entries:
+                    recent = list(messages.order_by('timestamp', direction='DESCENDING')
+                                  .limit(self.max_entries).stream(transaction=transaction))
+                    if len(recent) == self.max_entries:
+                        # The oldest of these leaves load()'s window with this append.
+                        dropped = recent[-1]
+                        summary = summarize(summary, dropped.get('incoming'), dropped.get('outgoing'),
+                                            dropped.get('timestamp'))
+                        fields['summary'] = summary
+                transaction.set(messages.document(), entry)
+                transaction.set(conversation, fields, merge=True)
+                return summary
+
+            self.summary_cache.put(sender_email, write(self.db.transaction()))
+        cached = self.history_cache.get(sender_email)
+        if cached is not None:
+            history = cached + [entry]
+            self.history_cache.put(sender_email, history[-self.max_entries:] if self.max_entries else history)
+
+
+_provider = None
+_provider_resolved = False
+_provider_lock = threading.Lock()
+
+
+def create_provider(config, db=None):
+    if db is None:
+        from google.cloud import firestore
+        key_path = config.get('firebase_key')
+        db = firestore.Client.from_service_account_json(key_path) if key_path else firestore.Client()
+    return FirestoreContextProvider(
+        db,
+        ttl=config.get('context_cache_ttl', DEFAULT_TTL_SECONDS),
+        max_senders=config.get('context_cache_max_senders', DEFAULT_MAX_SENDERS),
+        max_entries=config.get('history_max_entries', DEFAULT_MAX_ENTRIES),
+        use_listeners=config.get('context_listeners', True),
+        poll_interval=config.get('context_poll_interval', DEFAULT_POLL_INTERVAL))
+
+def get_context_provider():
+    """Return the process-wide provider if config.json selects context_backend "firestore", else None."""
+    global _provider, _provider_resolved
+    if not _provider_resolved:
+        with _provider_lock:
+            if not _provider_resolved:
+                config = get_config()
+                if config.get('context_backend') == 'firestore':
+                    _provider = create_provider(config)
+                _provider_resolved = True
+    return _provider
@@ -0,0 +1,147 @@
+import itertools
+import threading
+import time
+
+from google.oauth2 import service_account
+
+import vertexai
+from vertexai.generative_models import GenerativeModel
+
+from metrics import observe_latency, observe_tokens
+from rate_limit import call
+from settings import get_config
+
+# --- CONFIGURATION ---
+MODEL_NAME = "gemini-2.0-flash-001"
+VERTEX_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+_lock = threading.Lock()
+_models = {}
+_stats_lock = threading.Lock()
+_stats = {
+    'init_seconds': 0.0,
+    'cold': [],
+    'warm': [],
+    'first_token': [],
+}
+
+
+def _load_service_account_key():
+    return get_config()['service_account_key']
+
+def init_vertex(project, location):
+    """Initialise the Vertex AI SDK with the service account from config.json."""
+    credentials = service_account.Credentials.from_service_account_file(
+        _load_service_account_key(),
+        scopes=VERTEX_SCOPES
+    )
+    vertexai.init(project=project, location=location, credentials=credentials)
+
+def get_model(project, location, model_name=MODEL_NAME):
+    """Return the process-wide GenerativeModel, initialising Vertex AI on first use.
+
+    Credentials, vertexai.init and the model object are set up once per
+    (project, location, model_name) and shared by every thread afterwards.
+    """
+    key = (project, location, model_name)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            start = time.perf_counter()
+            init_vertex(project, location)
+            model = GenerativeModel(model_name)
+            _models[key] = model
+            with _stats_lock:
+                _stats['init_seconds'] += time.perf_counter() - start
+    return model
+
+def set_model(project, location, model, model_name=MODEL_NAME):
+    """Install an already-built model for (project, location), e.g. an offline stand-in."""
+    with _lock:
+        _models[(project, location, model_name)] = model
+
+def generate_content(project, location, prompt, model_name=MODEL_NAME):
+    """Run one generate_content call on the shared model and record its latency.
+
+    The call goes through the shared "gemini" rate limiter, so quota errors
+    are retried with backoff instead of failing the email.
+    """
+    cold = (project, location, model_name) not in _models
+    start = time.perf_counter()
+    model = get_model(project, location, model_name=model_name)
+    response = call('gemini', model.generate_content, prompt)
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats['cold' if cold else 'warm'].append(elapsed)
+    observe_tokens(getattr(response, 'usage_metadata', None))
+    return response
+
+def stream_content(project, location, prompt, model_name=MODEL_NAME, on_first_chunk=None):
+    """Generate with stream=True and return the full reply text.
+
+    Chunks are consumed as they arrive; on_first_chunk(text) is called as
+    soon as the first non-empty one lands so callers can start work that
+    doesn't need the whole reply. Time-to-first-token is recorded next to
+    the total latency.
+    """
+    cold = (project, location, model_name) not in _models
+    start = time.perf_counter()
+    model = get_model(project, location, model_name=model_name)
+
+    def open_stream():
+        # Quota errors surface when the stream opens or on its first chunk,
+        # so that much is retried; a stream that breaks midway is not.
+        chunks = iter(model.generate_content(prompt, stream=True))
+        first = next(chunks, None)
+        return itertools.chain([first] if first is not None else [], chunks)
+
+    parts = []
+    first_token = None
+    usage_metadata = None
+    for chunk in call('gemini', open_stream):
+        text = chunk.text
+        if text and first_token is None:
+            first_token = time.perf_counter() - start
+            observe_latency('gemini_first_token', first_token)
+            if on_first_chunk is not None:
+                on_first_chunk(text)
+        parts.append(text)
+        usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats['cold' if cold else 'warm'].append(elapsed)
+        if first_token is not None:
+            _stats['first_token'].append(first_token)
+    observe_tokens(usage_metadata)
+    return "".join(parts)
+
+def latency_summary():
+    """Return cold (first call, includes setup) vs warm per-call latency in seconds."""
+    with _stats_lock:
+        cold = list(_stats['cold'])
+        warm = list(_stats['warm'])
+        init_seconds = _stats['init_seconds']
+        first_token = list(_stats['first_token'])
+    return {
+        'init_seconds': init_seconds,
+        'cold_calls': len(cold),
+        'cold_avg_seconds': sum(cold) / len(cold) if cold else 0.0,
+        'warm_calls': len(warm),
+        'warm_avg_seconds': sum(warm) / len(warm) if warm else 0.0,
+        'streamed_calls': len(first_token),
+        'first_token_avg_seconds': sum(first_token) / len(first_token) if first_token else 0.0,
+    }
+
+def print_latency_summary():
+    summary = latency_summary()
+    if not summary['cold_calls'] and not summary['warm_calls']:
+        return
+    print(f"Gemini latency: setup {summary['init_seconds']:.2f}s, "
+          f"cold {summary['cold_avg_seconds']:.2f}s avg over {summary['cold_calls']} call(s), "
+          f"warm {summary['warm_avg_seconds']:.2f}s avg over {summary['warm_calls']} call(s)")
+    if summary['streamed_calls']:
+        print(f"Gemini streaming: first token after {summary['first_token_avg_seconds']:.2f}s avg "
+              f"over {summary['streamed_calls']} call(s)")
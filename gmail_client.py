@@ -0,0 +1,211 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+import google_auth_httplib2
+from googleapiclient.errors import HttpError
+
+from mime_parser import parse_body
+from rate_limit import call, execute, CircuitOpenError, GMAIL_COSTS
+
+# --- CONFIGURATION ---
+# Gmail accepts up to 100 calls per batch request but recommends staying at or below 50.
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_CONCURRENCY = 4
+LIST_PAGE_SIZE = 500
+UNREAD_QUERY = "is:unread"
+UNREAD_LABEL_IDS = ['CATEGORY_PERSONAL']
+BATCH_MODIFY_LIMIT = 1000
+
+_thread_state = threading.local()
+
+
+def thread_http(service):
+    """Return an authorized http object owned by the calling thread.
+
+    httplib2 connections are not thread-safe, so every worker thread that
+    executes Gmail requests needs its own transport built from the service's
+    credentials. Returns None when the service has no credentials attached,
+    in which case requests fall back to the service's own http.
+    """
+    credentials = getattr(getattr(service, '_http', None), 'credentials', None)
+    if credentials is None:
+        return None
+    cache = getattr(_thread_state, 'http', None)
+    if cache is None:
+        cache = _thread_state.http = {}
+    http = cache.get(id(credentials))
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        cache[id(credentials)] = http
+    return http
+
+
+def list_message_ids(service, user_id='me', query=UNREAD_QUERY, label_ids=None):
+    """List every message ID matching the query, following nextPageToken."""
+    if label_ids is None:
+        label_ids = UNREAD_LABEL_IDS
+    ids = []
+    page_token = None
+    while True:
+        results = execute(service.users().messages().list(
+            userId=user_id, labelIds=label_ids, q=query,
+            maxResults=LIST_PAGE_SIZE, pageToken=page_token), 'messages.list')
+        ids.extend(msg['id'] for msg in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return ids
+
+
+def parse_message(msg_data):
+    """Convert a full-format Gmail message into the agent's email dict.
+
+    A message with no body text but a subject ("Is the 2BR on Oak still
+    available?") gets the subject as its body and 'subject_only' set, since
+    the subject is the question the reply has to answer.
+    """
+    payload = msg_data['payload']
+    headers = payload['headers']
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "")
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), "")
+    # Header names are case-insensitive; Gmail preserves whatever the sender used.
+    header_map = {h['name'].lower(): h['value'] for h in headers}
+    body = parse_body(payload)
+    subject_only = not body and bool(subject.strip())
+    return {
+        'id': msg_data['id'],
+        'thread_id': msg_data.get('threadId', msg_data['id']),
+        'message_id': header_map.get('message-id', ""),
+        'references': header_map.get('references', ""),
+        'internal_date': int(msg_data.get('internalDate', 0)),
+        'subject': subject,
+        'sender': sender,
+        'body': subject.strip() if subject_only else body,
+        'subject_only': subject_only,
+        'headers': header_map
+    }
+
+
+def _fetch_batch(service, ids, user_id):
+    """Fetch one chunk of messages in a single Gmail batch request."""
+    fetched = {}
+    failed = []
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            failed.append(request_id)
+        else:
+            fetched[request_id] = response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for msg_id in ids:
+        batch.add(service.users().messages().get(userId=user_id, id=msg_id, format='full'),
+                  request_id=msg_id)
+    # A batch is billed as the sum of its calls.
+    call('gmail', batch.execute, cost=GMAIL_COSTS['messages.get'] * len(ids), http=thread_http(service))
+
+    # Individual calls inside a batch can fail (most often with 429s) while the
+    # rest succeed; retry each of those directly, with backoff.
+    for msg_id in failed:
+        try:
+            fetched[msg_id] = execute(service.users().messages().get(userId=user_id, id=msg_id, format='full'),
+                                      'messages.get', http=thread_http(service))
+        except (HttpError, CircuitOpenError) as error:
+            print(f"Skipping message {msg_id}: {error}")
+    return fetched
+
+
+def fetch_messages(service, ids, user_id='me', batch_size=DEFAULT_BATCH_SIZE,
+                   max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Fetch and parse the given message IDs, preserving their order."""
+    chunks = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    fetched = {}
+    if max_concurrency <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            fetched.update(_fetch_batch(service, chunk, user_id))
+    else:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            for result in pool.map(lambda chunk: _fetch_batch(service, chunk, user_id), chunks):
+                fetched.update(result)
+    return [parse_message(fetched[msg_id]) for msg_id in ids if msg_id in fetched]
+
+
+def add_reply_headers(message, email):
+    """Set In-Reply-To/References on a MIME reply to `email` so it threads in every mail client."""
+    if email.get('message_id'):
+        message['In-Reply-To'] = email['message_id']
+        message['References'] = f"{email.get('references', '')} {email['message_id']}".strip()
+
+
+def group_by_thread(emails):
+    """Collapse emails that share a Gmail thread into one email per thread.
+
+    Each merged email carries the latest message's sender, subject and
+    threading headers, every message ID in 'ids', and the thread's bodies
+    oldest first so one reply can answer all of them.
+    """
+    threads = {}
+    for position, email in enumerate(emails):
+        threads.setdefault(email['thread_id'], []).append((position, email))
+    grouped = []
+    for messages in threads.values():
+        # Gmail lists newest first; internalDate breaks ties when present.
+        messages.sort(key=lambda item: (item[1].get('internal_date', 0), -item[0]))
+        latest = messages[-1][1]
+        bodies = [email['body'] for _, email in messages if email['body'].strip()]
+        grouped.append(dict(latest,
+                            ids=[email['id'] for _, email in messages],
+                            body="\n\n---\n\n".join(bodies)))
+    return grouped
+
+
+def mark_read(service, ids, user_id='me'):
+    """Remove UNREAD from every message in `ids` using batchModify (1000 IDs per call)."""
+    ids = list(ids)
+    for i in range(0, len(ids), BATCH_MODIFY_LIMIT):
+        request = service.users().messages().batchModify(
+            userId=user_id, body={'ids': ids[i:i + BATCH_MODIFY_LIMIT], 'removeLabelIds': ['UNREAD']})
+        execute(request, 'messages.batchModify', http=thread_http(service))
+    return len(ids)
+
+
+class ReadMarker:
+    """Collects IDs of processed messages so they can be marked read in one batchModify.
+
+    on_flush, if given, is called with the IDs after each successful flush.
+    """
+
+    def __init__(self, service, user_id='me', on_flush=None):
+        self.service = service
+        self.user_id = user_id
+        self.on_flush = on_flush
+        self._ids = []
+        self._lock = threading.Lock()
+
+    def add(self, ids):
+        with self._lock:
+            self._ids.extend(ids)
+
+    def flush(self):
+        """Mark everything collected so far as read; returns how many messages that was."""
+        with self._lock:
+            ids, self._ids = self._ids, []
+        if not ids:
+            return 0
+        try:
+            count = mark_read(self.service, ids, user_id=self.user_id)
+        except Exception:
+            # Keep them for the next flush rather than leaving replied mail unread for good.
+            self.add(ids)
+            raise
+        if self.on_flush is not None:
+            self.on_flush(ids)
+        return count
+
+
+def fetch_unread_emails(service, user_id='me', batch_size=DEFAULT_BATCH_SIZE,
+                        max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Return every unread personal email as dicts from parse_message(), newest first."""
+    ids = list_message_ids(service, user_id=user_id)
+    return fetch_messages(service, ids, user_id=user_id, batch_size=batch_size,
+                          max_concurrency=max_concurrency)
@@ -0,0 +1,99 @@
+import json
+import time
+
+from googleapiclient.errors import HttpError
+
+from gmail_client import (fetch_messages, fetch_unread_emails, UNREAD_LABEL_IDS,
+                          DEFAULT_BATCH_SIZE, DEFAULT_MAX_CONCURRENCY)
+from rate_limit import execute
+
+# --- CONFIGURATION ---
+SYNC_STATE_PATH = "gmail_sync_state.json"
+# Messages that failed processing stay unread but never show up in history
+# again, so a periodic full resync picks them back up.
+DEFAULT_FULL_RESYNC_INTERVAL = 3600
+HISTORY_PAGE_SIZE = 500
+
+
+def load_sync_state(path=SYNC_STATE_PATH):
+    """Load the stored Gmail historyId checkpoint, or an empty state."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_sync_state(state, path=SYNC_STATE_PATH):
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+def current_history_id(service, user_id='me'):
+    return execute(service.users().getProfile(userId=user_id), 'getProfile')['historyId']
+
+def list_added_message_ids(service, start_history_id, user_id='me', label_ids=None):
+    """Return (message IDs added since start_history_id, latest historyId).
+
+    Only messages that are still unread and carry every label in `label_ids`
+    are returned. Raises HttpError with status 404 when the start ID is too
+    old for Gmail to serve.
+    """
+    if label_ids is None:
+        label_ids = UNREAD_LABEL_IDS
+    wanted = set(label_ids) | {'UNREAD'}
+    ids = []
+    seen = set()
+    history_id = start_history_id
+    page_token = None
+    while True:
+        results = execute(service.users().history().list(
+            userId=user_id, startHistoryId=start_history_id,
+            historyTypes=['messageAdded'], labelId=label_ids[0] if label_ids else None,
+            maxResults=HISTORY_PAGE_SIZE, pageToken=page_token), 'history.list')
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added['message']
+                if message['id'] in seen or not wanted.issubset(message.get('labelIds', [])):
+                    continue
+                seen.add(message['id'])
+                ids.append(message['id'])
+        history_id = results.get('historyId', history_id)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return ids, history_id
+
+def full_resync(service, state, user_id='me', batch_size=DEFAULT_BATCH_SIZE,
+                max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Fetch every unread email and reset the checkpoint to the current historyId."""
+    # Read the historyId before listing so nothing that arrives mid-scan is skipped.
+    history_id = current_history_id(service, user_id=user_id)
+    emails = fetch_unread_emails(service, user_id=user_id, batch_size=batch_size,
+                                 max_concurrency=max_concurrency)
+    state['history_id'] = history_id
+    state['last_full_sync'] = time.time()
+    return emails
+
+def poll_new_emails(service, state, user_id='me', batch_size=DEFAULT_BATCH_SIZE,
+                    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                    full_resync_interval=DEFAULT_FULL_RESYNC_INTERVAL):
+    """Return unread emails that arrived since the checkpoint in `state`.
+
+    Falls back to a full unread scan on first run, when the stored historyId
+    has expired, or once every `full_resync_interval` seconds. `state` is
+    updated in place; persist it with save_sync_state once the returned
+    emails have been handled.
+    """
+    if 'history_id' not in state or time.time() - state.get('last_full_sync', 0) > full_resync_interval:
+        return full_resync(service, state, user_id=user_id, batch_size=batch_size,
+                           max_concurrency=max_concurrency)
+    try:
+        ids, history_id = list_added_message_ids(service, state['history_id'], user_id=user_id)
+    except HttpError as error:
+        if error.resp.status != 404:
+            raise
+        print("Stored Gmail historyId has expired, running a full resync.")
+        return full_resync(service, state, user_id=user_id, batch_size=batch_size,
+                           max_concurrency=max_concurrency)
+    emails = fetch_messages(service, ids, user_id=user_id, batch_size=batch_size,
+                            max_concurrency=max_concurrency)
+    state['history_id'] = history_id
+    return emails
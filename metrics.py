@@ -0,0 +1,203 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- CONFIGURATION ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+# Raw samples kept per series for the JSON summary's percentiles.
+MAX_SAMPLES = 10000
+RUN_SUMMARY_PATH = "run_metrics.json"
+
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps recent raw samples for percentiles."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_lock = threading.Lock()
+_started = datetime.now().isoformat()
+_latency = {}
+_errors = {}
+_tokens = {}
+_counters = {}
+_throttled = {}
+_summaries = {}
+
+
+def observe_latency(stage, seconds):
+    with _lock:
+        _latency.setdefault(stage, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+def count_error(stage):
+    with _lock:
+        _errors[stage] = _errors.get(stage, 0) + 1
+
+def increment(name, amount=1):
+    """Bump a free-form counter such as emails_processed."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def observe_tokens(usage_metadata):
+    """Record prompt/response token counts from a Vertex AI response's usage_metadata."""
+    if usage_metadata is None:
+        return
+    with _lock:
+        for kind, attr in (('prompt', 'prompt_token_count'), ('response', 'candidates_token_count')):
+            value = getattr(usage_metadata, attr, None)
+            if value is not None:
+                _tokens.setdefault(kind, Histogram(TOKEN_BUCKETS)).observe(value)
+
+def register_summary(name, fn):
+    """Include fn()'s JSON-serialisable result under `name` in run_summary()."""
+    with _lock:
+        _summaries[name] = fn
+
+def observe_throttle(group, seconds):
+    """Add time spent waiting on a rate limiter or retry backoff for an API group."""
+    with _lock:
+        _throttled[group] = _throttled.get(group, 0.0) + seconds
+
+@contextmanager
+def timed(stage):
+    """Time a block as `stage`, counting an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        count_error(stage)
+        raise
+    finally:
+        observe_latency(stage, time.perf_counter() - start)
+
+def instrument(stage):
+    """Decorator form of timed()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+def _render_histogram(lines, name, label, key, hist):
+    for bound, count in zip(hist.buckets, hist.counts):
+        lines.append(f'{name}_bucket{{{label}="{key}",le="{_format_bound(bound)}"}} {count}')
+    lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {hist.count}')
+    lines.append(f'{name}_sum{{{label}="{key}"}} {hist.sum}')
+    lines.append(f'{name}_count{{{label}="{key}"}} {hist.count}')
+
+def render_prometheus():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        lines.append("# HELP agent_stage_latency_seconds Latency of each pipeline stage.")
+        lines.append("# TYPE agent_stage_latency_seconds histogram")
+        for stage, hist in sorted(_latency.items()):
+            _render_histogram(lines, "agent_stage_latency_seconds", "stage", stage, hist)
+        lines.append("# HELP agent_stage_errors_total Exceptions raised by each pipeline stage.")
+        lines.append("# TYPE agent_stage_errors_total counter")
+        for stage, count in sorted(_errors.items()):
+            lines.append(f'agent_stage_errors_total{{stage="{stage}"}} {count}')
+        lines.append("# HELP agent_gemini_tokens Tokens per Gemini call.")
+        lines.append("# TYPE agent_gemini_tokens histogram")
+        for kind, hist in sorted(_tokens.items()):
+            _render_histogram(lines, "agent_gemini_tokens", "kind", kind, hist)
+        lines.append("# HELP agent_throttled_seconds_total Time spent waiting on rate limits and retry backoff.")
+        lines.append("# TYPE agent_throttled_seconds_total counter")
+        for group, seconds in sorted(_throttled.items()):
+            lines.append(f'agent_throttled_seconds_total{{group="{group}"}} {seconds}')
+        for name, value in sorted(_counters.items()):
+            lines.append(f"# TYPE agent_{name}_total counter")
+            lines.append(f"agent_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+def run_summary():
+    """Return a JSON-serialisable summary of everything recorded in this process."""
+    def describe(hist):
+        return {
+            'count': hist.count,
+            'sum': hist.sum,
+            'avg': hist.sum / hist.count if hist.count else 0.0,
+            'p50': hist.percentile(0.50),
+            'p95': hist.percentile(0.95),
+            'p99': hist.percentile(0.99),
+            'max': max(hist.samples) if hist.samples else 0.0,
+        }
+    with _lock:
+        extra = dict(_summaries)
+        summary = {
+            'started': _started,
+            'finished': datetime.now().isoformat(),
+            'stages': {stage: dict(describe(hist), errors=_errors.get(stage, 0))
+                       for stage, hist in _latency.items()},
+            'errors': dict(_errors),
+            'tokens': {kind: describe(hist) for kind, hist in _tokens.items()},
+            'counters': dict(_counters),
+            'throttled_seconds': dict(_throttled),
+        }
+    for name, fn in extra.items():
+        summary[name] = fn()
+    return summary
+
+def write_run_summary(path=RUN_SUMMARY_PATH):
+    with open(path, 'w') as f:
+        json.dump(run_summary(), f, indent=2)
+    print(f"Run metrics written to {path}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') in ('', '/metrics'):
+            body = render_prometheus().encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path.rstrip('/') == '/summary':
+            body = json.dumps(run_summary(), indent=2).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Serve /metrics (Prometheus) and /summary (JSON) from a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,162 @@
+import base64
+import re
+from html.parser import HTMLParser
+
+# --- CONFIGURATION ---
+# Tenant questions fit in a few KB; anything past this is quoted history,
+# pasted listings or base64 noise and only slows decoding and prompting.
+DEFAULT_MAX_BYTES = 64 * 1024
+MAX_PARTS = 200
+
+_BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'ul', 'ol', 'hr'}
+_VOID_TAGS = {'br', 'hr', 'img', 'meta', 'link', 'input', 'col', 'area', 'base', 'wbr', 'source'}
+_SKIP_TAGS = {'script', 'style', 'head', 'title', 'blockquote'}
+# Containers mail clients wrap quoted replies in.
+_QUOTE_CLASSES = ('gmail_quote', 'yahoo_quoted', 'moz-cite-prefix', 'protonmail_quote')
+_QUOTE_IDS = ('divRplyFwdMsg', 'appendonsend')
+
+_REPLY_HEADER = re.compile(
+    r'^\s*(On\b.{0,200}\bwrote:|-{2,}\s*Original Message\s*-{2,}|-{2,}\s*Forwarded message\s*-{2,}'
+    r'|From:\s.+|_{10,})\s*$', re.IGNORECASE)
+_OUTLOOK_HEADER = re.compile(r'^\s*(Sent|Date|To|Subject):\s', re.IGNORECASE)
+_MOBILE_FOOTER = re.compile(
+    r'^\s*(Sent from my \w+|Sent from (Mail|Outlook|Yahoo Mail) for \w+|Get Outlook for \w+)', re.IGNORECASE)
+_BLANK_RUNS = re.compile(r'\n{3,}')
+
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text, skipping quoted-reply containers, scripts and styles."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def _is_quote(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            return True
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        return any(c in classes for c in _QUOTE_CLASSES) or attrs.get('id') in _QUOTE_IDS
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            if tag in _BLOCK_TAGS and not self._skip_depth:
+                self.parts.append('\n')
+            return
+        if self._skip_depth or self._is_quote(tag, attrs):
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        if self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Lightweight HTML to plain text: visible text with block elements on their own lines."""
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception:
+        # Badly broken markup: fall back to dropping the tags.
+        return re.sub(r'<[^>]+>', ' ', html)
+    lines = (' '.join(line.split()) for line in ''.join(extractor.parts).splitlines())
+    return _BLANK_RUNS.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def _header(part, name):
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), "")
+
+def _charset(part):
+    match = re.search(r'charset="?([\w.-]+)"?', _header(part, 'Content-Type'), re.IGNORECASE)
+    return match.group(1) if match else 'utf-8'
+
+def _is_attachment(part):
+    return bool(part.get('filename')) or 'attachment' in _header(part, 'Content-Disposition').lower()
+
+def decode_part(part, max_bytes=DEFAULT_MAX_BYTES):
+    """Decode a part's base64url body, reading at most about max_bytes of it."""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ""
+    if max_bytes:
+        # Every 4 base64 characters carry 3 bytes, so slice before decoding.
+        data = data[:-(-max_bytes // 3) * 4]
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    try:
+        return raw.decode(_charset(part), errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+def extract_body(payload, max_bytes=DEFAULT_MAX_BYTES):
+    """Return the best plain-text body of a Gmail message payload.
+
+    Walks the MIME tree depth-first with an explicit stack (no recursion
+    limit on deeply nested mail), preferring the first text/plain part and
+    falling back to the first text/html part converted to text.
+    Attachments are skipped and at most MAX_PARTS parts are examined.
+    """
+    stack = [payload]
+    html_part = None
+    seen = 0
+    while stack and seen < MAX_PARTS:
+        part = stack.pop()
+        seen += 1
+        mime_type = part.get('mimeType', '').lower()
+        if part.get('parts'):
+            # Reversed so parts are visited in document order.
+            stack.extend(reversed(part['parts']))
+            continue
+        if _is_attachment(part):
+            continue
+        if mime_type == 'text/plain' or (not mime_type and part is payload):
+            text = decode_part(part, max_bytes)
+            if text.strip():
+                return text
+        elif mime_type == 'text/html' and html_part is None:
+            html_part = part
+    if html_part is not None:
+        return html_to_text(decode_part(html_part, max_bytes))
+    return ""
+
+
+def strip_quoted(text):
+    """Drop quoted reply chains, signatures and mobile footers from a plain-text body."""
+    kept = []
+    lines = text.replace('\r\n', '\n').split('\n')
+    for i, line in enumerate(lines):
+        if line.rstrip() == '--' and line.startswith('--'):
+            # RFC 3676 signature delimiter ("-- ").
+            break
+        if _MOBILE_FOOTER.match(line):
+            break
+        if _REPLY_HEADER.match(line):
+            if not line.lstrip().lower().startswith('from:'):
+                break
+            # "From:" only starts a quoted message when Outlook's Sent/To/Subject lines follow.
+            following = [l for l in lines[i + 1:i + 5] if l.strip()]
+            if any(_OUTLOOK_HEADER.match(l) for l in following):
+                break
+        if line.lstrip().startswith('>'):
+            continue
+        kept.append(line.rstrip())
+    return _BLANK_RUNS.sub('\n\n', '\n'.join(kept)).strip()
+
+
+def parse_body(payload, max_bytes=DEFAULT_MAX_BYTES):
+    """Extract and clean the text a reply should answer."""
+    text = extract_body(payload, max_bytes=max_bytes)
+    # A bare forward is all "quote"; keep it rather than prompting with nothing.
+    return strip_quoted(text) or text.strip()
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import increment
+
+# --- CONFIGURATION ---
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_STAGE_LIMITS = {
+    'claim': 8,
+    'triage': 8,
+    'generate': 4,
+    'deliver': 2,
+}
+
+
+def stage_limits(config):
+    """Merge per-stage concurrency limits from config over the defaults."""
+    limits = dict(DEFAULT_STAGE_LIMITS)
+    limits.update(config.get('stage_concurrency', {}))
+    return limits
+
+
+def drain_queue(emails, stages, max_workers=DEFAULT_MAX_WORKERS):
+    """Run every email through the stages on a bounded pool of worker threads.
+
+    `stages` is a list of (name, fn, limit) tuples. Each email gets its own
+    context dict ({'email': email}) that is passed to every stage in order, so
+    a stage can read what earlier stages stored on it. At most `limit` emails
+    are inside a given stage at once. An exception in any stage abandons only
+    that email; the rest of the queue keeps going. A stage can set
+    ctx['done'] to end an email's run early without counting it as a failure,
+    and ctx['release'] to a callable that runs once the email leaves the
+    pipeline either way (the error, if any, is in ctx['error']).
+    """
+    semaphores = {name: threading.BoundedSemaphore(max(1, limit)) for name, _, limit in stages}
+    failures = []
+    failures_lock = threading.Lock()
+
+    def run(email):
+        ctx = {'email': email}
+        try:
+            for name, fn, _ in stages:
+                try:
+                    with semaphores[name]:
+                        fn(ctx)
+                except Exception as e:
+                    print(f"Failed to process email {email['id']} during {name}: {e}")
+                    ctx['error'] = f"{name}: {e}"
+                    with failures_lock:
+                        failures.append({'id': email['id'], 'stage': name, 'error': str(e)})
+                    return False
+                if ctx.get('done'):
+                    break
+            return True
+        finally:
+            release = ctx.get('release')
+            if release is not None:
+                release()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        succeeded = sum(pool.map(run, emails))
+    elapsed = time.perf_counter() - start
+    increment('emails_processed', succeeded)
+    increment('emails_failed', len(failures))
+
+    summary = {
+        'total': len(emails),
+        'succeeded': succeeded,
+        'failed': len(failures),
+        'failures': failures,
+        'elapsed_seconds': elapsed,
+        'emails_per_minute': succeeded / elapsed * 60 if elapsed > 0 else 0.0,
+    }
+    print(f"Processed {succeeded}/{len(emails)} emails in {elapsed:.1f}s "
+          f"({summary['emails_per_minute']:.1f} emails/minute), {len(failures)} failed.")
+    return summary
+
+
+def run_forever(poll, stages, on_drained=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                max_workers=DEFAULT_MAX_WORKERS):
+    """Poll for new emails every `poll_interval` seconds and drain each batch.
+
+    `poll` returns the emails to process; `on_drained` is called after each
+    batch has been handled (e.g. to persist a sync checkpoint). Errors from a
+    single poll are reported and retried on the next tick.
+    """
+    while True:
+        started = time.monotonic()
+        try:
+            emails = poll()
+            if emails:
+                drain_queue(emails, stages, max_workers=max_workers)
+            if on_drained is not None:
+                on_drained()
+        except Exception as e:
+            print(f"Polling failed: {e}")
+        time.sleep(max(0.0, poll_interval - (time.monotonic() - started)))
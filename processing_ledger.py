@@ -0,0 +1,218 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import increment, register_summary
+from settings import get_config
+
+# --- CONFIGURATION ---
+LEDGER_DB_PATH = "processing_ledger.db"
+# A claim held this long by a process that may still be alive (another
+# host, or a hung worker) is treated as abandoned.
+DEFAULT_LEASE_SECONDS = 900
+DEFAULT_RETENTION_DAYS = 30
+
+# Stages in the order an email passes them. GENERATED stores the reply,
+# SAVED means it is in conversation history, DELIVERED that it was sent or
+# drafted and DONE that the message is marked read.
+NEW = 'new'
+GENERATED = 'generated'
+SAVED = 'saved'
+DELIVERED = 'delivered'
+DONE = 'done'
+STAGES = (NEW, GENERATED, SAVED, DELIVERED, DONE)
+
+
+def reached(entry, stage):
+    """True if a claimed ledger entry has already completed `stage`."""
+    return entry is not None and STAGES.index(entry['stage']) >= STAGES.index(stage)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ProcessingLedger:
+    """Durable per-message record of how far processing got, in SQLite (WAL mode).
+
+    Keyed by Gmail message ID. A worker claims a message before touching it;
+    the claim is one BEGIN IMMEDIATE transaction, so concurrent threads and
+    processes sharing the file never both get it. Each completed stage is
+    written as it happens, together with the generated reply, so a restart
+    picks an email up at the first unfinished stage: no second Gemini call
+    for a stored reply and no second send for a delivered one.
+
+    Claims belong to this process ("host:pid"). A restarted process takes
+    over claims whose owner on this host is gone straight away, and any
+    other claim once its lease has expired.
+    """
+
+    def __init__(self, path=LEDGER_DB_PATH, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 retention_days=DEFAULT_RETENTION_DAYS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.local()
+        self._held = set()
+        self._held_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    message_id TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    route TEXT,
+                    reply TEXT,
+                    draft_id TEXT,
+                    owner TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated TEXT NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_stage ON messages (stage, updated)")
+        if retention_days:
+            self.prune(retention_days)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _owner_gone(self, owner, lease_until):
+        if lease_until is None or lease_until < time.time():
+            return True
+        host, _, pid = owner.rpartition(':')
+        return host == socket.gethostname() and pid.isdigit() and not _pid_alive(int(pid))
+
+    def claim(self, message_id):
+        """Claim a message for this process.
+
+        Returns its entry ({'stage', 'route', 'reply', 'draft_id', 'attempts'}) or None
+        when it is already done or another worker holds it.
+        """
+        with self._held_lock:
+            if message_id in self._held:
+                return None
+            self._held.add(message_id)
+        try:
+            now = datetime.now().isoformat()
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("INSERT OR IGNORE INTO messages (message_id, stage, updated) VALUES (?, ?, ?)",
+                             (message_id, NEW, now))
+                stage, route, reply, draft_id, owner, lease_until, attempts = conn.execute(
+                    "SELECT stage, route, reply, draft_id, owner, lease_until, attempts FROM messages "
+                    "WHERE message_id = ?", (message_id,)).fetchone()
+                if stage == DONE or (owner and owner != self.owner and not self._owner_gone(owner, lease_until)):
+                    entry = None
+                else:
+                    conn.execute("UPDATE messages SET owner = ?, lease_until = ?, attempts = attempts + 1, "
+                                 "updated = ? WHERE message_id = ?",
+                                 (self.owner, time.time() + self.lease_seconds, now, message_id))
+                    entry = {'stage': stage, 'route': route, 'reply': reply, 'draft_id': draft_id,
+                             'attempts': attempts + 1}
+        except Exception:
+            self._forget(message_id)
+            raise
+        if entry is None:
+            self._forget(message_id)
+            increment('ledger_skipped')
+        elif stage != NEW:
+            increment('ledger_resumed')
+        return entry
+
+    def complete(self, message_id, stage, reply=None, route=None):
+        """Record that `stage` finished for a message this process holds."""
+        with self._connect() as conn:
+            conn.execute("UPDATE messages SET stage = ?, reply = COALESCE(?, reply), route = COALESCE(?, route), "
+                         "error = NULL, updated = ? WHERE message_id = ? AND owner = ?",
+                         (stage, reply, route, datetime.now().isoformat(), message_id, self.owner))
+
+    def stages(self, message_ids):
+        """Return {message_id: stage} for the given IDs the ledger knows, without claiming them."""
+        ids = list(message_ids)
+        conn = self._connect()
+        found = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            found.update(conn.execute(
+                f"SELECT message_id, stage FROM messages WHERE message_id IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall())
+        return found
+
+    def set_draft(self, message_id, draft_id):
+        """Remember the Gmail draft started for a message, so a resumed run updates it instead of adding another."""
+        with self._connect() as conn:
+            conn.execute("UPDATE messages SET draft_id = ?, updated = ? WHERE message_id = ? AND owner = ?",
+                         (draft_id, datetime.now().isoformat(), message_id, self.owner))
+
+    def finish(self, message_ids):
+        """Mark messages DONE once they are marked read in Gmail (IDs the ledger doesn't track are ignored)."""
+        ids = list(message_ids)
+        now = datetime.now().isoformat()
+        with self._connect() as conn:
+            conn.executemany("UPDATE messages SET stage = ?, owner = NULL, lease_until = NULL, updated = ? "
+                             "WHERE message_id = ?", [(DONE, now, message_id) for message_id in ids])
+
+    def release(self, message_id, error=None):
+        """Give up this process's claim, e.g. after a failed stage, so the next run retries it."""
+        try:
+            with self._connect() as conn:
+                conn.execute("UPDATE messages SET owner = NULL, lease_until = NULL, error = COALESCE(?, error), "
+                             "updated = ? WHERE message_id = ? AND owner = ?",
+                             (error, datetime.now().isoformat(), message_id, self.owner))
+        finally:
+            self._forget(message_id)
+
+    def _forget(self, message_id):
+        with self._held_lock:
+            self._held.discard(message_id)
+
+    def prune(self, retention_days=DEFAULT_RETENTION_DAYS):
+        """Drop DONE entries older than retention_days; returns how many were removed."""
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM messages WHERE stage = ? AND updated < ?", (DONE, cutoff)).rowcount
+
+    def counts(self):
+        """Number of tracked messages per stage."""
+        rows = self._connect().execute("SELECT stage, COUNT(*) FROM messages GROUP BY stage").fetchall()
+        return dict(rows)
+
+
+_ledger = None
+_ledger_resolved = False
+_ledger_lock = threading.Lock()
+
+
+def create_ledger(config):
+    return ProcessingLedger(
+        path=config.get('ledger_db_path', LEDGER_DB_PATH),
+        lease_seconds=config.get('ledger_lease_seconds', DEFAULT_LEASE_SECONDS),
+        retention_days=config.get('ledger_retention_days', DEFAULT_RETENTION_DAYS))
+
+def get_ledger():
+    """Return the process-wide ledger, or None if config.json sets "processing_ledger" to false."""
+    global _ledger, _ledger_resolved
+    if not _ledger_resolved:
+        with _ledger_lock:
+            if not _ledger_resolved:
+                config = get_config()
+                if config.get('processing_ledger', True):
+                    _ledger = create_ledger(config)
+                    register_summary('ledger', _ledger.counts)
+                _ledger_resolved = True
+    return _ledger
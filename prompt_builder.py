@@ -0,0 +1,163 @@
+import re
+from datetime import datetime
+
+from property_index import tokenize
+
+# --- CONFIGURATION ---
+# Gemini averages roughly four characters of English per token. Counting
+# locally keeps prompt assembly free of extra API round trips; the real
+# counts still arrive with every response's usage_metadata.
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 6000
+# Share of whatever the system prompt and new email leave over that goes to
+# history first; the listings get the rest.
+DEFAULT_HISTORY_SHARE = 0.35
+# The new email is never dropped, but a pasted novel is cut to this many tokens.
+MAX_EMAIL_TOKENS = 2000
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_LINE_WORDS = 40
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_PROPERTY_BLOCK = re.compile(r'(?=\nProperty \d+:\n)')
+
+
+def count_tokens(text):
+    """Estimate how many Gemini tokens `text` takes."""
+    if not text:
+        return 0
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to about max_tokens, preferring a sentence (then word) boundary."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    cut = text[:max_tokens * CHARS_PER_TOKEN]
+    sentence_end = max(cut.rfind('. '), cut.rfind('? '), cut.rfind('! '), cut.rfind('\n'))
+    if sentence_end > len(cut) // 2:
+        return cut[:sentence_end + 1].rstrip()
+    word_end = cut.rfind(' ')
+    return (cut[:word_end] if word_end > 0 else cut).rstrip() + "..."
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_END.split(" ".join(text.split())) if s.strip()]
+
+def _relevance(query_terms, text):
+    terms = set(tokenize(text))
+    return len(query_terms & terms) / (len(terms) ** 0.5) if terms else 0.0
+
+
+# --- rolling history summary ---
+def _clip_words(text, max_words=SUMMARY_LINE_WORDS):
+    words = text.split()
+    return " ".join(words[:max_words]) + ("..." if len(words) > max_words else "")
+
+def summarize_exchange(email_body, reply, timestamp=None):
+    """One-line extractive digest of an exchange: the tenant's questions and the most on-topic answer."""
+    sentences = split_sentences(email_body)
+    questions = [s for s in sentences if s.endswith('?')] or sentences[:1]
+    asked = _clip_words(" ".join(questions))
+    question_terms = set(tokenize(" ".join(questions)))
+    answers = split_sentences(reply)
+    answer = max(answers, key=lambda s: _relevance(question_terms, s)) if answers else ""
+    day = (timestamp or datetime.now().isoformat())[:10]
+    line = f"- {day}: Tenant asked: {asked}"
+    if answer:
+        line += f" | Pandora replied: {_clip_words(answer)}"
+    return line
+
+def update_summary(summary, email_body, reply, timestamp=None, max_tokens=SUMMARY_MAX_TOKENS):
+    """Fold one exchange into a sender's rolling summary, dropping the oldest lines past max_tokens."""
+    lines = [line for line in (summary or "").splitlines() if line.strip()]
+    lines.append(summarize_exchange(email_body, reply, timestamp))
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+# --- prompt assembly ---
+def _fit_properties(property_context, budget):
+    """Keep whole listings, in the (relevance) order they were rendered, while they fit."""
+    if not property_context or count_tokens(property_context) <= budget:
+        return property_context or ""
+    header, *blocks = _PROPERTY_BLOCK.split(property_context)
+    kept, used = [header], count_tokens(header)
+    for block in blocks:
+        cost = count_tokens(block)
+        if used + cost > budget:
+            break
+        kept.append(block)
+        used += cost
+    return "".join(kept) if len(kept) > 1 else ""
+
+def _fit_history(email_body, summary, history, budget):
+    """Rolling summary first, then the recent exchanges most relevant to the new email."""
+    if budget <= 0 or not (summary or history):
+        return ""
+    parts = []
+    used = count_tokens("\n\nPREVIOUS CONVERSATION HISTORY:\n")
+    if summary:
+        summary = truncate_to_tokens(summary, budget // 2 if history else budget - used)
+        parts.append(f"\nSummary of earlier emails:\n{summary}\n")
+        used += count_tokens(parts[-1])
+    query_terms = set(tokenize(email_body))
+    ranked = sorted(range(len(history)), reverse=True,
+                    key=lambda i: (_relevance(query_terms, history[i]['incoming']), i))
+    chosen = {}
+    for i in ranked:
+        remaining = budget - used
+        entry = history[i]
+        text = f"\nTenant: {entry['incoming']}\nPandora: {entry['outgoing']}\n"
+        if count_tokens(text) > remaining:
+            if chosen or remaining < 50:
+                continue
+            # Nothing fits whole; keep the single most relevant exchange, shortened.
+            half = remaining // 2 - 8
+            text = (f"\nTenant: {truncate_to_tokens(entry['incoming'], half)}\n"
+                    f"Pandora: {truncate_to_tokens(entry['outgoing'], half)}\n")
+        chosen[i] = text
+        used += count_tokens(text)
+    if chosen:
+        if summary:
+            parts.append("\nRecent emails:")
+        parts.extend(chosen[i] for i in sorted(chosen))
+    return "\n\nPREVIOUS CONVERSATION HISTORY:\n" + "".join(parts)
+
+def build_prompt(system_prompt, instructions, email_body, property_context="", summary="",
+                 history=(), token_budget=DEFAULT_TOKEN_BUDGET, history_share=DEFAULT_HISTORY_SHARE):
+    """Assemble the Gemini prompt within token_budget.
+
+    The system prompt and instructions are always sent in full and the new
+    email is only cut if it alone exceeds MAX_EMAIL_TOKENS. What is left is
+    split between history (history_share) and property listings, with
+    either side's unused allowance passed to the other. Listings are dropped
+    from the least relevant end; history keeps the rolling summary plus as
+    many of the most relevant recent exchanges as fit.
+
+    Returns (prompt, report) where report records the estimated tokens of
+    each section.
+    """
+    email_body = truncate_to_tokens(email_body, MAX_EMAIL_TOKENS)
+    head = f"{system_prompt}\n\n{instructions}\n\n"
+    tail = f"\n\nEmail from prospective tenant:\n{email_body}"
+    remaining = max(0, token_budget - count_tokens(head) - count_tokens(tail))
+
+    history_budget = int(remaining * history_share)
+    history_context = _fit_history(email_body, summary, list(history), history_budget)
+    property_budget = remaining - count_tokens(history_context)
+    property_context = _fit_properties(property_context, property_budget)
+    # Hand any allowance the listings did not need back to the history.
+    spare = remaining - count_tokens(property_context)
+    if spare > history_budget:
+        history_context = _fit_history(email_body, summary, list(history), spare)
+
+    prompt = f"{head}{property_context}{history_context}{tail}"
+    report = {
+        'budget': token_budget,
+        'fixed': count_tokens(head) + count_tokens(tail),
+        'properties': count_tokens(property_context),
+        'history': count_tokens(history_context),
+        'total': count_tokens(prompt),
+    }
+    return prompt, report
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+# --- CONFIGURATION ---
+EXCEL_PATH = "Properties Listing.xlsx"
+# Pickled DataFrame keyed by the spreadsheet's content hash, so a fresh
+# process can skip openpyxl entirely when the listing has not changed.
+SNAPSHOT_PATH = ".property_snapshot.pkl"
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _read_snapshot(snapshot_path, digest):
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+        return None
+    if snapshot.get('digest') != digest:
+        return None
+    return snapshot['df']
+
+def _write_snapshot(snapshot_path, digest, df):
+    tmp_path = f"{snapshot_path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'digest': digest, 'df': df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        print(f"Warning: could not write property snapshot: {e}")
+
+def render_property_context(df):
+    """Render the listing as the prompt's PROPERTY INFORMATION block.
+
+    Builds one object array of label+value strings per column and joins them
+    row-major in a single pass instead of growing the string row by row.
+    """
+    if df.empty:
+        return "PROPERTY INFORMATION:\n"
+    columns = [np.array([f"\nProperty {i + 1}:\n" for i in range(len(df))], dtype=object)]
+    for column in df.columns:
+        values = df[column].to_numpy(dtype=object).astype(str).astype(object)
+        columns.append(f"  {column}: " + values + "\n")
+    return "PROPERTY INFORMATION:\n" + "".join(np.stack(columns, axis=1).ravel())
+
+def _load_entry(path, snapshot_path):
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    entry = _cache.get(path)
+    if entry is not None and entry['signature'] == signature:
+        return entry
+    with _lock:
+        entry = _cache.get(path)
+        if entry is not None and entry['signature'] == signature:
+            return entry
+        digest = _file_digest(path)
+        if entry is not None and entry['digest'] == digest:
+            # Touched but unchanged; keep the parsed data.
+            entry = dict(entry, signature=signature)
+        else:
+            df = _read_snapshot(snapshot_path, digest) if snapshot_path else None
+            if df is None:
+                df = pd.read_excel(path)
+                if snapshot_path:
+                    _write_snapshot(snapshot_path, digest, df)
+            entry = {
+                'signature': signature,
+                'digest': digest,
+                'df': df,
+                'context': render_property_context(df),
+            }
+        _cache[path] = entry
+        return entry
+
+def load_catalog(path=EXCEL_PATH, snapshot_path=SNAPSHOT_PATH):
+    """Return (DataFrame, content hash) for the listing as one consistent pair."""
+    entry = _load_entry(path, snapshot_path)
+    return entry['df'], entry['digest']
+
+def load_properties(path=EXCEL_PATH, snapshot_path=SNAPSHOT_PATH):
+    """Return the listing DataFrame, re-parsing only when the file changes."""
+    return _load_entry(path, snapshot_path)['df']
+
+def get_property_context(path=EXCEL_PATH, snapshot_path=SNAPSHOT_PATH):
+    """Return the rendered property context, cached until the file changes."""
+    return _load_entry(path, snapshot_path)['context']
+
+def catalog_fingerprint(path=EXCEL_PATH, snapshot_path=SNAPSHOT_PATH):
+    """Return the content hash of the listing currently in the cache."""
+    return _load_entry(path, snapshot_path)['digest']
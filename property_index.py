@@ -0,0 +1,108 @@
+import math
+import re
+import threading
+
+import numpy as np
+
+from property_catalog import load_catalog, render_property_context, EXCEL_PATH, SNAPSHOT_PATH
+
+# --- CONFIGURATION ---
+DEFAULT_TOP_K = 5
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_lock = threading.Lock()
+_index_cache = {}
+
+
+def tokenize(text):
+    """Lowercase word tokens with a crude plural strip ("bedrooms" -> "bedroom")."""
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text).lower()):
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def _row_text(df):
+    """Yield one "column value column value ..." string per listing row."""
+    columns = [str(column) for column in df.columns]
+    for values in df.itertuples(index=False, name=None):
+        parts = []
+        for column, value in zip(columns, values):
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            parts.append(f"{column} {value}")
+        yield " ".join(parts)
+
+
+class PropertyIndex:
+    """BM25 inverted index over the listing rows.
+
+    Postings are stored as numpy arrays per term, so memory grows with the
+    number of (row, term) pairs rather than rows x vocabulary, and a query
+    only touches the postings of its own terms.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        postings = {}
+        lengths = []
+        for row, text in enumerate(_row_text(df)):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(row)
+                postings[token][1].append(count)
+
+        n_rows = len(lengths)
+        doc_len = np.asarray(lengths, dtype=np.float32)
+        avg_len = float(doc_len.mean()) if n_rows else 0.0
+        norm = K1 * (1 - B + B * doc_len / avg_len) if avg_len else doc_len
+        self.postings = {}
+        for token, (rows, counts) in postings.items():
+            rows = np.asarray(rows, dtype=np.int32)
+            tf = np.asarray(counts, dtype=np.float32)
+            idf = math.log(1 + (n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            self.postings[token] = (rows, (idf * tf * (K1 + 1) / (tf + norm[rows])).astype(np.float32))
+        self.n_rows = n_rows
+
+    def search(self, query, top_k=DEFAULT_TOP_K):
+        """Return row positions of the top_k best matches, best first.
+
+        Ties (including rows that share no terms with the query) keep their
+        spreadsheet order.
+        """
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for token in set(tokenize(query)):
+            entry = self.postings.get(token)
+            if entry is not None:
+                scores[entry[0]] += entry[1]
+        return np.argsort(-scores, kind='stable')[:top_k]
+
+
+def get_index(path=EXCEL_PATH, snapshot_path=SNAPSHOT_PATH):
+    """Return the index for the current listing, rebuilding when the file changes."""
+    df, digest = load_catalog(path, snapshot_path)
+    entry = _index_cache.get(path)
+    if entry is not None and entry[0] == digest:
+        return entry[1]
+    with _lock:
+        entry = _index_cache.get(path)
+        if entry is None or entry[0] != digest:
+            entry = (digest, PropertyIndex(df))
+            _index_cache[path] = entry
+    return entry[1]
+
+def retrieve_property_context(query, top_k=DEFAULT_TOP_K, path=EXCEL_PATH,
+                              snapshot_path=SNAPSHOT_PATH):
+    """Render only the top_k listings most relevant to the query."""
+    index = get_index(path, snapshot_path)
+    rows = index.search(query, top_k=top_k)
+    return render_property_context(index.df.iloc[rows])
@@ -0,0 +1,251 @@
+import email.utils
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from metrics import increment, observe_throttle
+from settings import get_config
+
+# --- CONFIGURATION ---
+# Gmail meters each user in quota units (250/s); Vertex AI quotas are per
+# request. Override per group under "rate_limits" in config.json.
+DEFAULT_LIMITS = {
+    'gmail': {'rate': 250, 'burst': 250},
+    'gemini': {'rate': 10, 'burst': 20},
+}
+# Gmail quota units per method (https://developers.google.com/gmail/api/reference/quota).
+GMAIL_COSTS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.send': 100,
+    'messages.modify': 5,
+    'messages.batchModify': 50,
+    'drafts.create': 10,
+    'drafts.update': 15,
+    'drafts.delete': 10,
+    'history.list': 2,
+    'getProfile': 1,
+}
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an API whose circuit breaker is open."""
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """Take `cost` tokens, sleeping until they are available; returns seconds waited."""
+        cost = min(float(cost), self.burst)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return waited
+                delay = (cost - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive throttling/server errors.
+
+    While open every call fails fast with CircuitOpenError; after
+    `reset_timeout` seconds one trial call is let through (half-open) and
+    its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self, group):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"{group} circuit is open after repeated failures")
+                self.state = 'half_open'
+            elif self.state == 'half_open':
+                raise CircuitOpenError(f"{group} circuit is half-open; a trial call is in flight")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = 'closed'
+
+    def record_failure(self):
+        """Count a failure; returns True if this opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                opened = self.state != 'open'
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                return opened
+            return False
+
+
+def _status(error):
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None) if resp is not None else getattr(error, 'code', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error):
+    """Throttling, transient server and connection errors from googleapiclient or google.api_core."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = _status(error)
+    if status in RETRYABLE_STATUSES:
+        return True
+    # Gmail reports per-user rate limits as 403s.
+    return status == 403 and any(reason in str(error) for reason in RATE_LIMIT_REASONS)
+
+def retry_after(error):
+    """Seconds from the error's Retry-After header, or None."""
+    headers = getattr(error, 'resp', None)
+    if headers is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers is None:
+        return None
+    # httplib2 lower-cases header names; requests keeps them case-insensitive.
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    """Token bucket, retry policy and circuit breaker for one API/quota group."""
+
+    def __init__(self, group, rate, burst, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.group = group
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self.throttled_seconds = 0.0
+        self.retries = 0
+        self.circuit_opens = 0
+
+    def _throttled(self, seconds):
+        if seconds <= 0:
+            return
+        with self._lock:
+            self.throttled_seconds += seconds
+        observe_throttle(self.group, seconds)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given (1-based) retry."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, fn, *args, cost=1, **kwargs):
+        """Run fn under the bucket, retrying throttling/server errors with backoff."""
+        for attempt in range(1, self.max_attempts + 1):
+            self.breaker.before_call(self.group)
+            self._throttled(self.bucket.acquire(cost))
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error):
+                    # Not throttling or an outage; don't hold it against the API.
+                    self.breaker.record_success()
+                    raise
+                if self.breaker.record_failure():
+                    with self._lock:
+                        self.circuit_opens += 1
+                    increment(f'{self.group}_circuit_opens')
+                if attempt == self.max_attempts:
+                    raise
+                delay = retry_after(error)
+                delay = min(self.max_delay, delay) if delay is not None else self.backoff(attempt)
+                with self._lock:
+                    self.retries += 1
+                increment(f'{self.group}_retries')
+                time.sleep(delay)
+                self._throttled(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'throttled_seconds': self.throttled_seconds,
+                'retries': self.retries,
+                'circuit_opens': self.circuit_opens,
+                'circuit_state': self.breaker.state,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(group):
+    """Return the process-wide limiter for `group`, shared by every thread."""
+    limiter = _limiters.get(group)
+    if limiter is not None:
+        return limiter
+    with _limiters_lock:
+        limiter = _limiters.get(group)
+        if limiter is None:
+            settings = dict(DEFAULT_LIMITS.get(group, {'rate': 10, 'burst': 10}))
+            settings.update(get_config().get('rate_limits', {}).get(group, {}))
+            limiter = _limiters[group] = RateLimiter(group, **settings)
+    return limiter
+
+def call(group, fn, *args, cost=1, **kwargs):
+    """Run fn(*args, **kwargs) through the shared limiter for `group`."""
+    return get_limiter(group).call(fn, *args, cost=cost, **kwargs)
+
+def execute(request, method, http=None, group='gmail'):
+    """Execute a googleapiclient request under the Gmail quota, costed by method name."""
+    return call(group, request.execute, cost=GMAIL_COSTS.get(method, 5), http=http)
+
+def throttle_summary():
+    with _limiters_lock:
+        return {group: limiter.stats() for group, limiter in _limiters.items()}
+
+def print_throttle_summary():
+    for group, stats in sorted(throttle_summary().items()):
+        if stats['throttled_seconds'] or stats['retries'] or stats['circuit_opens']:
+            print(f"{group} throttling: {stats['throttled_seconds']:.2f}s waiting, {stats['retries']} retries, "
+                  f"{stats['circuit_opens']} circuit opens (circuit {stats['circuit_state']})")
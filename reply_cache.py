@@ -0,0 +1,211 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import increment, register_summary
+from settings import get_config
+
+# --- CONFIGURATION ---
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_MAX_ENTRIES = 1000
+# Smallest estimated Jaccard similarity (over word unigrams + bigrams) still
+# treated as the same question.
+DEFAULT_MIN_SIMILARITY = 0.7
+# MinHash signature of NUM_PERM slots split into LSH bands of BAND_ROWS rows;
+# 16 bands of 4 make pairs above ~0.5 similarity very likely to share a band,
+# and candidates are then checked against min_similarity.
+NUM_PERM = 64
+BAND_ROWS = 4
+_MERSENNE_PRIME = (1 << 61) - 1
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+# Numbers (budgets, bedrooms, unit and street numbers) and capitalised words
+# (names, streets, neighbourhoods) in the original text.
+_FACT_RE = re.compile(r"\b(?:[\w'$.,-]*\d[\w'$.,-]*|[A-Z][\w'-]*)")
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERM)]
+
+
+def normalize_body(text):
+    """Lowercase, drop quoted reply lines and punctuation, collapse whitespace."""
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith('>')]
+    return " ".join(_WORD_RE.findall(" ".join(lines).lower()))
+
+def extract_facts(text):
+    """Numbers and capitalised words of an email; near-duplicates must agree on all of them."""
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith('>')]
+    return frozenset(token.strip('.,').lower() for token in _FACT_RE.findall("\n".join(lines)))
+
+def minhash(text):
+    """MinHash signature over the word unigrams and bigrams of normalised text."""
+    words = text.split()
+    features = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+    if not features:
+        return (0,) * NUM_PERM
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), 'big')
+              for f in features]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / NUM_PERM
+
+def _bands(signature):
+    return [(i, signature[i:i + BAND_ROWS]) for i in range(0, NUM_PERM, BAND_ROWS)]
+
+
+class ReplyCache:
+    """TTL/LRU cache of generated replies keyed on email body + property context.
+
+    Lookups try an exact hash of the normalised body first, then a MinHash/LSH
+    near-duplicate search among entries generated from the same property
+    context. A near-duplicate is only reused when it mentions exactly the
+    same numbers and names, since a reply sized for another budget or
+    greeting another tenant is wrong however similar the wording. Everything
+    is dropped when the listing spreadsheet changes.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES,
+                 min_similarity=DEFAULT_MIN_SIMILARITY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._catalog_digest = None
+        self._stats = {
+            'exact_hits': 0,
+            'near_hits': 0,
+            'misses': 0,
+            'generations': 0,
+            'generation_seconds': 0.0,
+        }
+
+    @staticmethod
+    def _key(normalized, context_fingerprint):
+        return hashlib.sha256(f"{context_fingerprint}\0{normalized}".encode()).hexdigest()
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        for band in _bands(entry['signature']):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def check_catalog(self, catalog_digest):
+        """Drop every cached reply if the property spreadsheet has changed."""
+        with self._lock:
+            if self._catalog_digest is not None and catalog_digest != self._catalog_digest:
+                self._entries.clear()
+                self._buckets.clear()
+            self._catalog_digest = catalog_digest
+
+    def get(self, email_body, property_context):
+        """Return a cached reply for this email and context, or None."""
+        normalized = normalize_body(email_body)
+        context_fingerprint = hashlib.sha256(property_context.encode()).hexdigest()
+        key = self._key(normalized, context_fingerprint)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry['created'] <= self.ttl:
+                self._entries.move_to_end(key)
+                return self._hit('exact_hits', entry['reply'])
+
+            signature = minhash(normalized)
+            facts = extract_facts(email_body)
+            best = None
+            for band in _bands(signature):
+                for candidate_key in self._buckets.get(band, ()):
+                    candidate = self._entries[candidate_key]
+                    if (candidate['context'] != context_fingerprint or candidate['facts'] != facts
+                            or now - candidate['created'] > self.ttl):
+                        continue
+                    score = similarity(candidate['signature'], signature)
+                    if score >= self.min_similarity and (best is None or score > best[0]):
+                        best = (score, candidate_key)
+            if best is not None:
+                self._entries.move_to_end(best[1])
+                return self._hit('near_hits', self._entries[best[1]]['reply'])
+            self._stats['misses'] += 1
+        increment('reply_cache_misses')
+        return None
+
+    def _hit(self, kind, reply):
+        # Called with the lock held.
+        self._stats[kind] += 1
+        generations = self._stats['generations']
+        increment(f'reply_cache_{kind}')
+        if generations:
+            increment('reply_cache_seconds_saved', self._stats['generation_seconds'] / generations)
+        return reply
+
+    def put(self, email_body, property_context, reply, generation_seconds=None):
+        """Store a freshly generated reply; generation_seconds feeds the latency-saved metric."""
+        normalized = normalize_body(email_body)
+        context_fingerprint = hashlib.sha256(property_context.encode()).hexdigest()
+        key = self._key(normalized, context_fingerprint)
+        signature = minhash(normalized)
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = {
+                'reply': reply,
+                'signature': signature,
+                'facts': extract_facts(email_body),
+                'context': context_fingerprint,
+                'created': time.time(),
+            }
+            for band in _bands(signature):
+                self._buckets.setdefault(band, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+            if generation_seconds is not None:
+                self._stats['generations'] += 1
+                self._stats['generation_seconds'] += generation_seconds
+
+    def stats(self):
+        """Return hit/miss counts, hit rate and estimated generation time saved."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['exact_hits'] + stats['near_hits'] + stats['misses']
+        hits = stats['exact_hits'] + stats['near_hits']
+        avg_generation = stats['generation_seconds'] / stats['generations'] if stats['generations'] else 0.0
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        stats['seconds_saved'] = hits * avg_generation
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide reply cache, configured from config.json on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = get_config()
+                _cache = ReplyCache(
+                    ttl=config.get('reply_cache_ttl', DEFAULT_TTL_SECONDS),
+                    max_entries=config.get('reply_cache_max_entries', DEFAULT_MAX_ENTRIES),
+                    min_similarity=config.get('reply_cache_min_similarity', DEFAULT_MIN_SIMILARITY))
+                register_summary('reply_cache', _cache.stats)
+    return _cache
+
+def print_cache_summary():
+    stats = get_cache().stats()
+    lookups = stats['exact_hits'] + stats['near_hits'] + stats['misses']
+    if not lookups:
+        return
+    print(f"Reply cache: {stats['exact_hits']} exact and {stats['near_hits']} near-duplicate hit(s) "
+          f"out of {lookups} lookup(s) ({stats['hit_rate']:.0%}), ~{stats['seconds_saved']:.1f}s of generation saved")
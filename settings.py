@@ -0,0 +1,35 @@
+import json
+import threading
+
+# --- CONFIGURATION ---
+CONFIG_PATH = "config.json"
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def load_config(path=CONFIG_PATH):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def use_config(config):
+    """Make `config` the settings every process-wide store, cache and client is built from.
+
+    Entry points call this with the config they already loaded; call it
+    before the first get_store()/get_cache()/get_ledger()/... to take effect.
+    """
+    global _config
+    with _config_lock:
+        _config = config
+
+def get_config():
+    """Return the config passed to use_config, or config.json read once ({} if there is none)."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                try:
+                    _config = load_config()
+                except FileNotFoundError:
+                    _config = {}
+    return _config
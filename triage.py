@@ -0,0 +1,264 @@
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+from metrics import increment, register_summary
+from property_index import tokenize
+from settings import get_config
+
+# --- CONFIGURATION ---
+SKIP = 'skip'
+LIGHT = 'light'
+FULL = 'full'
+DEFAULT_LIGHT_MODEL = "gemini-2.0-flash-lite-001"
+DEFAULT_LIGHT_TOP_K = 2
+DEFAULT_LIGHT_TOKEN_BUDGET = 1500
+# Posterior the classifier needs before mail skips or takes the light path;
+# anything less certain gets the full prompt.
+DEFAULT_SKIP_CONFIDENCE = 0.85
+DEFAULT_LIGHT_CONFIDENCE = 0.7
+TEMPLATE_REPLY = ("Hi,\n\nThanks for getting in touch. I've received your message and will follow up "
+                  "with the details shortly.\n\nBest regards,\nPandora")
+
+_AUTOMATED_SENDER = re.compile(r'(mailer-daemon|postmaster|no-?reply|do-?not-?reply|bounce|notifications?)@',
+                               re.IGNORECASE)
+_AUTO_REPLY_HEADERS = ('x-autoreply', 'x-autorespond')
+
+# Seed examples for the local classifier. Labels: "inquiry" needs the full
+# prompt, "simple" can be answered by the light model, "ack" and "auto" need
+# no reply. Extend them with a JSONL file of {"text", "label"} lines
+# (config "triage_training_path").
+SEED_EXAMPLES = [
+    ("inquiry", "Is the 2 bedroom apartment on Oak St still available? Are pets allowed?"),
+    ("inquiry", "What is the monthly rent and does it include utilities like water and heat?"),
+    ("inquiry", "I saw your listing for the house on Maple Ave. How many bathrooms does it have and is there parking?"),
+    ("inquiry", "Do you have any condos with 3 bedrooms under $2500 near good schools?"),
+    ("inquiry", "Is the townhouse furnished? What are the lease terms and the security deposit?"),
+    ("inquiry", "Hello, I'm interested in the studio. When is it available and what is the application process?"),
+    ("inquiry", "Does the apartment have in-unit laundry, a balcony, or central air?"),
+    ("inquiry", "We are a family of four looking for a house with a backyard. Which of your properties would fit?"),
+    ("inquiry", "Can I schedule a showing of the loft this weekend? Also, is the rent negotiable for a longer lease?"),
+    ("inquiry", "Are utilities included in the rent, and is the building secure? Is there a garage?"),
+    ("simple", "Can we move the showing to Tuesday at 3pm instead?"),
+    ("simple", "Could you resend the application link please?"),
+    ("simple", "What is the best phone number to reach you?"),
+    ("simple", "Is 10am tomorrow okay to come by?"),
+    ("simple", "I'm running about 15 minutes late for the viewing."),
+    ("simple", "Can I bring my partner to the showing?"),
+    ("simple", "Did you receive my application?"),
+    ("simple", "What time works for you on Friday?"),
+    ("ack", "Thanks!"),
+    ("ack", "Thank you so much, that's very helpful."),
+    ("ack", "Got it, thanks."),
+    ("ack", "Perfect, see you then."),
+    ("ack", "Sounds good, thank you!"),
+    ("ack", "Great, thanks for the quick reply."),
+    ("ack", "Ok will do."),
+    ("ack", "Received, thank you."),
+    ("ack", "Awesome, appreciate it!"),
+    ("auto", "I am out of the office until Monday with limited access to email. I will respond when I return."),
+    ("auto", "This is an automatic reply. Your message has been received."),
+    ("auto", "Delivery Status Notification (Failure). The message could not be delivered to the recipient."),
+    ("auto", "Your weekly newsletter: top listings and market news. Click here to unsubscribe."),
+    ("auto", "Your order has shipped. Track your package with the link below."),
+    ("auto", "Undeliverable: mailbox unavailable. The email account that you tried to reach does not exist."),
+    ("auto", "You are receiving this email because you subscribed to our mailing list. Manage preferences."),
+    ("auto", "Thank you for contacting support. A ticket has been created and an agent will respond."),
+]
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over word tokens with Laplace smoothing."""
+
+    def __init__(self, examples):
+        self.word_counts = {}
+        self.label_counts = Counter()
+        vocabulary = set()
+        for label, text in examples:
+            self.label_counts[label] += 1
+            counts = self.word_counts.setdefault(label, Counter())
+            for token in self.features(text):
+                counts[token] += 1
+                vocabulary.add(token)
+        self.vocabulary_size = len(vocabulary) or 1
+        self.totals = {label: sum(counts.values()) for label, counts in self.word_counts.items()}
+        total_examples = sum(self.label_counts.values())
+        self.log_priors = {label: math.log(count / total_examples) for label, count in self.label_counts.items()}
+
+    @staticmethod
+    def features(text):
+        tokens = tokenize(text)
+        # Length matters: a two-word "thanks!" is rarely a question.
+        size = 'tiny' if len(tokens) <= 4 else 'short' if len(tokens) <= 15 else 'long'
+        return tokens + [f"__len_{size}__"] + (["__question__"] if '?' in text else [])
+
+    def predict(self, text):
+        """Return (label, posterior probability)."""
+        tokens = self.features(text)
+        scores = {}
+        for label, log_prior in self.log_priors.items():
+            counts = self.word_counts[label]
+            denominator = self.totals[label] + self.vocabulary_size
+            scores[label] = log_prior + sum(math.log((counts[token] + 1) / denominator) for token in tokens)
+        best = max(scores, key=scores.get)
+        normaliser = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normaliser
+
+
+def _sender_address(sender):
+    match = re.search(r'<([^>]+)>', sender)
+    return (match.group(1) if match else sender).strip().lower()
+
+
+class Triage:
+    """Decides, before any Gemini call, whether and how an email gets answered.
+
+    Header and sender rules run first (auto-replies, bounces, mailing lists,
+    blocklisted senders are skipped); the parsed body then goes through a
+    local naive Bayes classifier. Routes are SKIP (mark read, no reply),
+    LIGHT (smaller model, small prompt, or a template) and FULL.
+    """
+
+    def __init__(self, blocklist=(), examples=SEED_EXAMPLES, skip_confidence=DEFAULT_SKIP_CONFIDENCE,
+                 light_confidence=DEFAULT_LIGHT_CONFIDENCE):
+        self.blocklist = {entry.lower() for entry in blocklist}
+        self.classifier = NaiveBayes(examples)
+        self.skip_confidence = skip_confidence
+        self.light_confidence = light_confidence
+        self._lock = threading.Lock()
+        self.routes = Counter()
+        self.reasons = Counter()
+        self.generation = {LIGHT: [0, 0.0], FULL: [0, 0.0]}
+
+    def _rule(self, email):
+        headers = email.get('headers', {})
+        auto_submitted = headers.get('auto-submitted', 'no').strip().lower()
+        if auto_submitted != 'no':
+            return 'auto_submitted'
+        if any(name in headers for name in _AUTO_REPLY_HEADERS):
+            return 'auto_reply'
+        if 'list-unsubscribe' in headers or 'list-id' in headers:
+            return 'mailing_list'
+        if headers.get('precedence', '').strip().lower() in ('bulk', 'list', 'junk', 'auto_reply'):
+            return 'bulk'
+        if 'multipart/report' in headers.get('content-type', '').lower():
+            return 'bounce'
+        address = _sender_address(email.get('sender', ''))
+        if address in self.blocklist or '@' + address.rpartition('@')[2] in self.blocklist:
+            return 'blocklisted'
+        if _AUTOMATED_SENDER.search(address):
+            return 'automated_sender'
+        if not email.get('body', '').strip() and not email.get('subject', '').strip():
+            return 'empty'
+        return None
+
+    def classify(self, email):
+        """Return {'route', 'reason', 'label', 'confidence'} for a parsed email.
+
+        Mail whose body parse_message took from the subject ('subject_only')
+        always gets the full prompt.
+        """
+        reason = self._rule(email)
+        if reason is not None:
+            decision = {'route': SKIP, 'reason': reason, 'label': None, 'confidence': 1.0}
+        elif email.get('subject_only'):
+            # A one-line question in the subject is too short for the classifier to judge.
+            decision = {'route': FULL, 'reason': 'subject_only', 'label': None, 'confidence': 1.0}
+        else:
+            label, confidence = self.classifier.predict(f"{email.get('subject', '')}\n{email['body']}")
+            # Anything that asks a question gets answered, however thankful it sounds.
+            if label in ('ack', 'auto') and confidence >= self.skip_confidence and '?' not in email['body']:
+                route = SKIP
+            elif label == 'simple' and confidence >= self.light_confidence:
+                route = LIGHT
+            else:
+                route = FULL
+            decision = {'route': route, 'reason': f"classifier:{label}", 'label': label, 'confidence': confidence}
+        with self._lock:
+            self.routes[decision['route']] += 1
+            self.reasons[decision['reason']] += 1
+        increment(f"triage_{decision['route']}")
+        return decision
+
+    def record_generation(self, route, seconds):
+        """Note how long a LIGHT or FULL generation took, for the time-saved estimate."""
+        with self._lock:
+            entry = self.generation[route]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def stats(self):
+        with self._lock:
+            routes = dict(self.routes)
+            reasons = dict(self.reasons)
+            (light_n, light_s), (full_n, full_s) = self.generation[LIGHT], self.generation[FULL]
+        full_avg = full_s / full_n if full_n else None
+        light_avg = light_s / light_n if light_n else 0.0
+        saved = None
+        if full_avg is not None:
+            saved = routes.get(SKIP, 0) * full_avg + routes.get(LIGHT, 0) * max(0.0, full_avg - light_avg)
+        return {
+            'routes': routes,
+            'reasons': reasons,
+            'full_avg_seconds': full_avg,
+            'light_avg_seconds': light_avg if light_n else None,
+            'seconds_saved': saved,
+        }
+
+
+def light_options(config):
+    """generate_reply_with_gemini overrides for LIGHT mail, or None to answer with TEMPLATE_REPLY."""
+    model_name = config.get('triage_light_model', DEFAULT_LIGHT_MODEL)
+    if not model_name or model_name == 'template':
+        return None
+    return {
+        'model_name': model_name,
+        'top_k': config.get('triage_light_top_k', DEFAULT_LIGHT_TOP_K),
+        'token_budget': config.get('triage_light_token_budget', DEFAULT_LIGHT_TOKEN_BUDGET),
+    }
+
+
+_triage = None
+_triage_lock = threading.Lock()
+
+
+def load_examples(path):
+    examples = list(SEED_EXAMPLES)
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append((record['label'], record['text']))
+    return examples
+
+def create_triage(config):
+    path = config.get('triage_training_path')
+    return Triage(
+        blocklist=config.get('triage_blocklist', ()),
+        examples=load_examples(path) if path else SEED_EXAMPLES,
+        skip_confidence=config.get('triage_skip_confidence', DEFAULT_SKIP_CONFIDENCE),
+        light_confidence=config.get('triage_light_confidence', DEFAULT_LIGHT_CONFIDENCE))
+
+def get_triage():
+    """Return the process-wide triage, configured from config.json on first use."""
+    global _triage
+    if _triage is None:
+        with _triage_lock:
+            if _triage is None:
+                config = get_config()
+                _triage = create_triage(config)
+                register_summary('triage', _triage.stats)
+    return _triage
+
+def print_triage_summary():
+    if _triage is None:
+        return
+    stats = _triage.stats()
+    if not stats['routes']:
+        return
+    routes = ", ".join(f"{count} {route}" for route, count in sorted(stats['routes'].items()))
+    saved = f"~{stats['seconds_saved']:.1f}s of generation saved" if stats['seconds_saved'] is not None \
+        else "no full generations to estimate time saved"
+    print(f"Triage: {routes}; {saved}")
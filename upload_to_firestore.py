@@ -1,20 +1,176 @@
+import argparse
+import hashlib
+import json
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 from google.cloud import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
 import os
 
 # --- Configuration ---
 EXCEL_FILE_PATH = 'Properties Listing.xlsx'
+COLLECTION_NAME = 'properties'
+# Column whose value identifies a property across spreadsheet edits
+PROPERTY_KEY_COLUMN = 'Address'
+# Stored on every document so unchanged rows can be skipped on the next sync
+CONTENT_HASH_FIELD = '_content_hash'
+# Firestore rejects batched writes with more than 500 operations
+BATCH_LIMIT = 500
+DEFAULT_MAX_OPS_PER_SECOND = 500
+DEFAULT_MAX_IN_FLIGHT = 8
 # Ensure your service account key has Firestore permissions
 # Set the environment variable before running:
 # export GOOGLE_APPLICATION_CREDENTIALS="path/to/your/service_account_key.json"
+# To sync against the local emulator instead, export FIRESTORE_EMULATOR_HOST=localhost:8080
+
+
+def property_doc_id(key):
+    """Stable, readable document ID for a property key, e.g. '456-oak-ave-anytown-usa-1a2b3c4d'."""
+    key = str(key).strip()
+    slug = re.sub(r'[^a-z0-9]+', '-', key.lower()).strip('-')[:80]
+    return f"{slug}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+def _clean_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if hasattr(value, 'item'):
+        # numpy scalars -> plain Python values Firestore can serialise
+        value = value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+def content_hash(document):
+    return hashlib.sha256(json.dumps(document, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def build_documents(df, key_column=PROPERTY_KEY_COLUMN):
+    """Return {doc_id: document} for every row with a usable key; duplicates keep the first row."""
+    if key_column not in df.columns:
+        raise KeyError(f"Key column '{key_column}' not found in spreadsheet columns {list(df.columns)}")
+    documents = {}
+    for position, record in enumerate(df.to_dict('records')):
+        document = {str(column): _clean_value(value) for column, value in record.items()}
+        key = document.get(str(key_column))
+        if key is None or str(key).strip() == "":
+            print(f"  - Skipping row {position + 2}: no value in '{key_column}'")
+            continue
+        doc_id = property_doc_id(key)
+        if doc_id in documents:
+            print(f"  - Skipping row {position + 2}: duplicate '{key_column}' value '{key}'")
+            continue
+        document[CONTENT_HASH_FIELD] = content_hash(document)
+        documents[doc_id] = document
+    return documents
+
+def existing_hashes(collection):
+    """Return {doc_id: stored content hash} without downloading full documents."""
+    return {snapshot.id: (snapshot.to_dict() or {}).get(CONTENT_HASH_FIELD)
+            for snapshot in collection.select([CONTENT_HASH_FIELD]).stream()}
+
+def plan_sync(documents, existing, delete_missing=True):
+    """Split the sync into (documents to write, IDs to delete, number unchanged)."""
+    writes = {doc_id: document for doc_id, document in documents.items()
+              if existing.get(doc_id) != document[CONTENT_HASH_FIELD]}
+    deletes = [doc_id for doc_id in existing if doc_id not in documents] if delete_missing else []
+    return writes, deletes, len(documents) - len(writes)
+
+def _apply_bulk(db, collection, writes, deletes, max_ops_per_second):
+    failures = []
+
+    def on_error(failure, writer):
+        # Let BulkWriter retry transient failures a few times before giving up on a row.
+        if failure.attempts < 5:
+            return True
+        failures.append(failure)
+        return False
+
+    writer = db.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=min(DEFAULT_MAX_OPS_PER_SECOND, max_ops_per_second),
+        max_ops_per_second=max_ops_per_second))
+    writer.on_write_error(on_error)
+    for doc_id, document in writes.items():
+        writer.set(collection.document(doc_id), document)
+    for doc_id in deletes:
+        writer.delete(collection.document(doc_id))
+    writer.close()
+    return len(failures)
+
+def _apply_batches(db, collection, writes, deletes, max_in_flight):
+    operations = [('set', doc_id, document) for doc_id, document in writes.items()]
+    operations += [('delete', doc_id, None) for doc_id in deletes]
+    chunks = [operations[i:i + BATCH_LIMIT] for i in range(0, len(operations), BATCH_LIMIT)]
 
-def upload_properties_to_firestore():
+    def commit(chunk):
+        batch = db.batch()
+        for op, doc_id, document in chunk:
+            if op == 'set':
+                batch.set(collection.document(doc_id), document)
+            else:
+                batch.delete(collection.document(doc_id))
+        try:
+            batch.commit()
+            return 0
+        except Exception as e:
+            print(f"  - Batch of {len(chunk)} writes failed: {e}")
+            return len(chunk)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        return sum(pool.map(commit, chunks))
+
+def sync_properties(db, df, key_column=PROPERTY_KEY_COLUMN, collection_name=COLLECTION_NAME,
+                    mode='bulk', delete_missing=True, max_ops_per_second=DEFAULT_MAX_OPS_PER_SECOND,
+                    max_in_flight=DEFAULT_MAX_IN_FLIGHT, dry_run=False):
+    """Make the Firestore collection match the DataFrame, writing only what changed.
+
+    mode='bulk' uses Firestore's BulkWriter (rate-limited, parallel, with
+    retries); mode='batch' commits 500-write batches on up to max_in_flight
+    threads, which also works with clients that lack bulk_writer.
     """
-    A one-time script to read property data from an Excel file
-    and upload it to a 'properties' collection in Firestore.
+    start = time.perf_counter()
+    collection = db.collection(collection_name)
+    documents = build_documents(df, key_column=key_column)
+    existing = existing_hashes(collection)
+    writes, deletes, unchanged = plan_sync(documents, existing, delete_missing=delete_missing)
+
+    failed = 0
+    if not dry_run and (writes or deletes):
+        if mode == 'bulk':
+            failed = _apply_bulk(db, collection, writes, deletes, max_ops_per_second)
+        else:
+            failed = _apply_batches(db, collection, writes, deletes, max_in_flight)
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'rows': len(df),
+        'written': len(writes),
+        'deleted': len(deletes),
+        'unchanged': unchanged,
+        'failed': failed,
+        'elapsed_seconds': elapsed,
+        'rows_per_second': len(df) / elapsed if elapsed else 0.0,
+    }
+    prefix = "Dry run: would write" if dry_run else "Wrote"
+    print(f"{prefix} {stats['written']}, deleted {stats['deleted']}, skipped {stats['unchanged']} unchanged "
+          f"({stats['failed']} failed) in {elapsed:.2f}s - {stats['rows_per_second']:.1f} rows/sec")
+    return stats
+
+def upload_properties_to_firestore(mode='bulk', delete_missing=True, dry_run=False,
+                                   key_column=PROPERTY_KEY_COLUMN,
+                                   max_ops_per_second=DEFAULT_MAX_OPS_PER_SECOND,
+                                   max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    """
+    Sync property data from the Excel file to the 'properties' collection in
+    Firestore. Safe to re-run: documents are keyed by the property's address
+    and only new or changed rows are written, while rows removed from the
+    sheet are deleted.
     """
     try:
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "firebase_key.json"
+        if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "firebase_key.json"
         # Initialize Firestore Client
         db = firestore.Client()
         print("Successfully connected to Firestore.")
@@ -23,23 +179,12 @@ def upload_properties_to_firestore():
         df = pd.read_excel(EXCEL_FILE_PATH)
         print(f"Reading data from '{EXCEL_FILE_PATH}'...")
 
-        # Get a reference to the 'properties' collection
-        properties_collection = db.collection('properties')
-
-        # Iterate over each row in the DataFrame and upload it
-        for index, row in df.iterrows():
-            # Convert row to a dictionary
-            property_data = row.to_dict()
-            
-            # Use a specific ID if you have one, or let Firestore auto-generate
-            # For simplicity, we'll use the property name or let it be auto-ID'd
-            # Let's use the index as a document ID for now
-            doc_id = str(index)
-            
-            properties_collection.document(doc_id).set(property_data)
-            print(f"  - Uploaded property with ID: {doc_id}")
-
-        print("\nAll properties have been successfully uploaded to Firestore!")
+        stats = sync_properties(db, df, key_column=key_column, mode=mode, delete_missing=delete_missing,
+                                max_ops_per_second=max_ops_per_second, max_in_flight=max_in_flight,
+                                dry_run=dry_run)
+        if not dry_run and not stats['failed']:
+            print("\nFirestore properties are in sync with the spreadsheet!")
+        return stats
 
     except FileNotFoundError:
         print(f"ERROR: The file '{EXCEL_FILE_PATH}' was not found.")
@@ -49,11 +194,26 @@ def upload_properties_to_firestore():
         print("Please ensure your GCP authentication is set up correctly.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync 'Properties Listing.xlsx' to Firestore.")
+    parser.add_argument('--mode', choices=['bulk', 'batch'], default='bulk',
+                        help="BulkWriter (default) or parallel 500-write batches")
+    parser.add_argument('--key-column', default=PROPERTY_KEY_COLUMN,
+                        help="spreadsheet column that identifies a property")
+    parser.add_argument('--keep-missing', action='store_true',
+                        help="don't delete documents whose rows were removed from the sheet")
+    parser.add_argument('--max-ops-per-second', type=int, default=DEFAULT_MAX_OPS_PER_SECOND)
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="concurrent batch commits in --mode batch")
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without writing")
+    args = parser.parse_args()
+
     # Important: Make sure you've set up your GCP credentials.
     # The simplest way is to run `gcloud auth application-default login`
     # or set the GOOGLE_APPLICATION_CREDENTIALS environment variable.
-    if not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
+    if not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS') and not os.environ.get('FIRESTORE_EMULATOR_HOST'):
         print("WARNING: GOOGLE_APPLICATION_CREDENTIALS environment variable not set.")
         print("The script might fail if default credentials are not configured.")
-    
-    upload_properties_to_firestore() 
\ No newline at end of file
+
+    upload_properties_to_firestore(mode=args.mode, delete_missing=not args.keep_missing, dry_run=args.dry_run,
+                                   key_column=args.key_column, max_ops_per_second=args.max_ops_per_second,
+                                   max_in_flight=args.max_in_flight)